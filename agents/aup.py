@@ -1,6 +1,73 @@
 #!/usr/bin/env python3
 
+from array import array
+from collections import defaultdict
+import time
 import numpy as np
+from agents.prefix_cache import PrefixCache
+
+
+class PlannerStats():
+    """
+    Counters for one planning call, cheap enough to leave on.
+    """
+
+    def __init__(self):
+        self.nodes_expanded = 0
+        self.cache_hits, self.cache_misses = 0, 0  # plan table lookups
+        self.env_steps, self.env_resets, self.checkpoint_restores = 0, 0, 0  # made by restarts
+        self.penalty_evaluations = 0
+        self.depth_time = defaultdict(float)  # seconds spent at each search depth, subtrees included
+        self.peak_plans, self.peak_checkpoints = 0, 0
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats['depth_time'] = dict(self.depth_time)
+        return stats
+
+    def __repr__(self):
+        return 'PlannerStats(' + ', '.join('{}={}'.format(k, v) for k, v in self.as_dict().items()) + ')'
+
+
+class PlanTable():
+    """
+    Search results per (board, steps_left) node, kept in flat arrays: the best first action, the return of acting
+    on it, and the node it leads to. Full plans are rebuilt by following successors, so memory is O(nodes).
+    """
+
+    def __init__(self):
+        self.nodes = dict()  # (board, steps_left) -> node index
+        self.actions, self.values, self.successors = array('b'), array('d'), array('l')
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def __getitem__(self, key):
+        return self.nodes[key]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, key, action, value, successor):
+        """Store a node's best action, its return, and the successor node index (-1 if the plan ends there)."""
+        self.nodes[key] = len(self.actions)
+        self.actions.append(action)
+        self.values.append(value)
+        self.successors.append(successor)
+        return self.nodes[key]
+
+    def value(self, node):
+        """The return of the plan starting at the node; the empty plan (-1) is worth nothing."""
+        return self.values[node] if node != -1 else 0
+
+    def plan(self, node):
+        """The action sequence starting at the node."""
+        actions = []
+        while node != -1:
+            actions.append(self.actions[node])
+            node = self.successors[node]
+        return actions
+
 
 class AUPAgent():
     """
@@ -9,13 +76,14 @@ class AUPAgent():
     name = 'AUP'
 
     def __init__(self, attainable_Q, lambd=1/1.501, discount=.996, baseline='stepwise', deviation='absolute',
-                 use_scale=False):
+                 use_scale=False, prefix_cache_size=5000):
         """
         :param attainable_Q: Q functions for the attainable set.
         :param lambd: Scale harshness of penalty.
         :param discount:
         :param baseline: That with respect to which we calculate impact.
         :param deviation: How to penalize shifts in attainable utility.
+        :param prefix_cache_size: How many env checkpoints to keep for restarts; 0 always replays from reset.
         """
         self.attainable_Q = attainable_Q
         self.lambd = lambd
@@ -34,7 +102,9 @@ class AUPAgent():
         if baseline == 'inaction' and deviation == 'decrease':
             self.name = 'Relative reachability'
 
-        self.cached_actions = dict()
+        self.plans = PlanTable()
+        self.prefix_cache = PrefixCache(prefix_cache_size)
+        self.stats = PlannerStats()
 
     def get_actions(self, env, steps_left, so_far=[]):
         """Figure out the n-step optimal plan, returning it and its return.
@@ -42,38 +112,97 @@ class AUPAgent():
         :param steps_left: How many steps to plan over.
         :param so_far: Actions taken up until now.
         """
-        if steps_left == 0: return [], 0
+        self.stats = PlannerStats()
+        node = self.search(env, steps_left, so_far)
+        return self.plans.plan(node), self.plans.value(node)
+
+    def search(self, env, steps_left, so_far=[]):
+        """Fill in the plan table below the current state, returning the index of its node (-1 for no steps left).
+        :param env: Simulator.
+        :param steps_left: How many steps to plan over.
+        :param so_far: Actions taken up until now.
+        """
+        if steps_left == 0: return -1
         if len(so_far) == 0:
-            if self.baseline == 'start':
-                self.null = self.attainable_Q[str(env.get_obs()['board'])].max(axis=1)
-            elif self.baseline == 'inaction':
-                self.restart(env, [env.actions['null']] * steps_left)
-                self.null = self.attainable_Q[str(env.get_obs()['board'])].max(axis=1)
-                env.reset()
+            self.prefix_cache.clear()  # checkpoints are only valid for the env they were taken in
+            self.set_baseline(env, steps_left)
         current_hash = (str(env.get_obs()['board']), steps_left)
-        if current_hash not in self.cached_actions:
-            best_actions, best_ret = [], float('-inf')
+        if current_hash not in self.plans:
+            self.stats.cache_misses += 1
+            self.stats.nodes_expanded += 1
+            start = time.perf_counter()
+            best_action, best_ret, best_next = -1, float('-inf'), -1
             for a in range(len(env.actions)): # for each available action
                 r, done = self.penalized_reward(env, a, steps_left, so_far)
-                if not done:
-                    actions, ret = self.get_actions(env, steps_left - 1, so_far + [a])
-                else:
-                    actions, ret = [], 0
-                ret *= self.discount
+                next_node = self.search(env, steps_left - 1, so_far + [a]) if not done else -1
+                ret = self.discount * self.plans.value(next_node)
                 if r + ret > best_ret:
-                    best_actions, best_ret = [a] + actions, r + ret
-                self.restart(env, so_far)
+                    best_action, best_ret, best_next = a, r + ret, next_node
+                self.restart(env, so_far, self.prefix_cache, self.stats)
 
-            self.cached_actions[current_hash] = best_actions, best_ret
-        return self.cached_actions[current_hash]
+            self.plans.add(current_hash, best_action, best_ret, best_next)
+            self.stats.peak_plans = max(self.stats.peak_plans, len(self.plans))
+            self.stats.depth_time[len(so_far)] += time.perf_counter() - start
+        else:
+            self.stats.cache_hits += 1
+        return self.plans[current_hash]
+
+    def set_baseline(self, env, steps_left):
+        """Fix the attainable utilities of the 'start' or 'inaction' baseline for a plan from the current state.
+        :param env: Simulator.
+        :param steps_left: How many steps the plan covers.
+        """
+        if self.baseline == 'start':
+            self.null = self.attainable_Q[str(env.get_obs()['board'])].max(axis=1)
+        elif self.baseline == 'inaction':
+            self.restart(env, [env.actions['null']] * steps_left, self.prefix_cache, self.stats)
+            self.null = self.attainable_Q[str(env.get_obs()['board'])].max(axis=1)
+            env.reset()
 
     @staticmethod
-    def restart(env, actions):
-        """Reset the environment and return the result of executing the action sequence."""
-        time_step = env.reset()
-        for action in actions:
-            if time_step.last: break
-            time_step = env.step(action)
+    def restart(env, actions, cache=None, stats=None):
+        """Reset the environment and return the result of executing the action sequence.
+        :param cache: PrefixCache to resume from the deepest checkpointed prefix of the actions, and to checkpoint
+                      the reached state in.
+        :param stats: PlannerStats to count env calls in.
+        """
+        depth, checkpoint = cache.deepest(actions) if cache is not None else (0, None)
+        if checkpoint is None:
+            last = env.reset().last
+        else:
+            env.restore(checkpoint)
+            last = env.terminated
+        steps = 0
+        for action in actions[depth:]:
+            if last: break
+            last = env.step(action).last
+            steps += 1
+        if cache is not None and depth < len(actions):
+            cache.store(actions, env.checkpoint())
+        if stats is not None:
+            stats.env_steps += steps
+            if checkpoint is None:
+                stats.env_resets += 1
+            else:
+                stats.checkpoint_restores += 1
+            if cache is not None:
+                stats.peak_checkpoints = max(stats.peak_checkpoints, len(cache))
+
+    @staticmethod
+    def rollout_boards(env, action, steps_left, so_far=[], cache=None, stats=None):
+        """The boards reached by taking the action and then idling, and by idling instead, until the plan ends.
+        Leaves the environment in the idling state.
+        :param env: Simulator.
+        :param action: The action in question.
+        :param steps_left: How many steps are left in the plan.
+        :param so_far: Actions taken up until now.
+        :param cache: PrefixCache for the restarts.
+        :param stats: PlannerStats for the restarts.
+        """
+        AUPAgent.restart(env, so_far + [action] + [env.actions['null']] * (steps_left - 1), cache, stats)
+        action_board = str(env.get_obs()['board'])
+        AUPAgent.restart(env, so_far + [env.actions['null']] * steps_left, cache, stats)
+        return action_board, str(env.get_obs()['board'])
 
     def penalized_reward(self, env, action, steps_left, so_far=[]):
         """The penalized reward for taking the given action in the current state. Steps the environment forward.
@@ -87,30 +216,119 @@ class AUPAgent():
         time_step = env.step(action)
         reward, scaled_penalty = time_step.reward if time_step.reward else 0, 0
         if self.attainable_Q:
-            action_plan, inaction_plan = so_far + [action] + [env.actions['null']] * (steps_left - 1), \
-                                         so_far + [env.actions['null']] * steps_left
+            action_board, inaction_board = self.rollout_boards(env, action, steps_left, so_far, self.prefix_cache,
+                                                               self.stats)
+            action_attainable = self.attainable_Q[action_board].max(axis=1)
+            null_attainable = self.attainable_Q[inaction_board][:, env.actions['null']] \
+                if self.baseline == 'stepwise' else self.null
+            scaled_penalty = self.penalty(action_attainable, null_attainable)
+            self.stats.penalty_evaluations += 1
+            self.restart(env, so_far + [action], self.prefix_cache, self.stats)
+        return reward - scaled_penalty, time_step.last
 
-            self.restart(env, action_plan)
-            action_attainable = self.attainable_Q[str(env.get_obs()['board'])].max(axis=1)
+    def penalty(self, action_attainable, null_attainable):
+        """The scaled penalty for shifting attainable utilities from the baseline's to the action's.
+        :param action_attainable: Attainable utilities after acting.
+        :param null_attainable: Attainable utilities under the baseline.
+        """
+        diff = action_attainable - null_attainable
+        if self.deviation == 'decrease':
+            diff[diff > 0] = 0  # don't penalize increases
 
-            self.restart(env, inaction_plan)
-            null_attainable = self.attainable_Q[str(env.get_obs()['board'])][:, env.actions['null']] \
-                if self.baseline == 'stepwise' else self.null
-            diff = action_attainable - null_attainable
-            if self.deviation == 'decrease':
-                diff[diff > 0] = 0  # don't penalize increases
-
-            # Scaling number or vector (per-AU)
-            if self.use_scale:
-                scale = sum(abs(null_attainable))
-                if scale == 0:
-                    scale = 1
-                penalty = sum(abs(diff) / scale)
-            else:
-                scale = np.copy(null_attainable)
-                scale[scale == 0] = 1  # avoid division by zero
-                penalty = np.average(np.divide(abs(diff), scale))
+        # Scaling number or vector (per-AU)
+        if self.use_scale:
+            scale = sum(abs(null_attainable))
+            if scale == 0:
+                scale = 1
+            penalty = sum(abs(diff) / scale)
+        else:
+            scale = np.copy(null_attainable)
+            scale[scale == 0] = 1  # avoid division by zero
+            penalty = np.average(np.divide(abs(diff), scale))
 
-            scaled_penalty = self.lambd * penalty
-            self.restart(env, so_far + [action])
-        return reward - scaled_penalty, time_step.last
\ No newline at end of file
+        return self.lambd * penalty
+
+
+class MultiAUPPlanner():
+    """
+    Exhaustive planner for several AUP variants at once, e.g. the baselines and deviations of an ablation.
+
+    The variants explore the same tree, so each node's rollouts and attainable utility lookups are shared and only
+    the penalties differ.
+    """
+
+    def __init__(self, agents, prefix_cache_size=5000):
+        """
+        :param agents: AUPAgents to plan for. Their plans are stored in their own plan tables, so a later
+                       agent.get_actions() from the same state returns immediately.
+        :param prefix_cache_size: How many env checkpoints to keep for restarts; 0 always replays from reset.
+        """
+        self.agents = agents
+        self.prefix_cache = PrefixCache(prefix_cache_size)
+        self.stats = PlannerStats()
+
+    def get_actions(self, env, steps_left, so_far=[]):
+        """Figure out every agent's n-step optimal plan, returning a list of (plan, return) pairs in agent order.
+        :param env: Simulator.
+        :param steps_left: How many steps to plan over.
+        :param so_far: Actions taken up until now.
+        """
+        self.stats = PlannerStats()
+        nodes = self.search(env, steps_left, so_far)
+        return [(agent.plans.plan(node), agent.plans.value(node)) for agent, node in zip(self.agents, nodes)]
+
+    def search(self, env, steps_left, so_far=[]):
+        """Fill in every agent's plan table below the current state, returning the agents' node indices."""
+        if steps_left == 0: return [-1] * len(self.agents)
+        if len(so_far) == 0:
+            self.prefix_cache.clear()
+            for agent in self.agents:
+                agent.set_baseline(env, steps_left)
+        current_hash = (str(env.get_obs()['board']), steps_left)
+        if not all(current_hash in agent.plans for agent in self.agents):
+            self.stats.cache_misses += 1
+            self.stats.nodes_expanded += 1
+            start = time.perf_counter()
+            best = [(-1, float('-inf'), -1)] * len(self.agents)
+            for a in range(len(env.actions)): # for each available action
+                rewards, done = self.penalized_rewards(env, a, steps_left, so_far)
+                next_nodes = self.search(env, steps_left - 1, so_far + [a]) if not done else [-1] * len(self.agents)
+                for idx, (agent, r, next_node) in enumerate(zip(self.agents, rewards, next_nodes)):
+                    ret = agent.discount * agent.plans.value(next_node)
+                    if r + ret > best[idx][1]:
+                        best[idx] = a, r + ret, next_node
+                AUPAgent.restart(env, so_far, self.prefix_cache, self.stats)
+
+            for agent, (action, ret, next_node) in zip(self.agents, best):
+                if current_hash not in agent.plans:
+                    agent.plans.add(current_hash, action, ret, next_node)
+            self.stats.peak_plans = max(self.stats.peak_plans, max(len(agent.plans) for agent in self.agents))
+            self.stats.depth_time[len(so_far)] += time.perf_counter() - start
+        else:
+            self.stats.cache_hits += 1
+        return [agent.plans[current_hash] for agent in self.agents]
+
+    def penalized_rewards(self, env, action, steps_left, so_far=[]):
+        """Every agent's penalized reward for taking the given action in the current state. Steps the environment
+        forward.
+        :returns penalized_rewards: One per agent.
+        :returns is_last: Whether the episode is terminated.
+        """
+        time_step = env.step(action)
+        reward = time_step.reward if time_step.reward else 0
+        penalized = [reward] * len(self.agents)
+        if any(agent.attainable_Q for agent in self.agents):
+            action_board, inaction_board = AUPAgent.rollout_boards(env, action, steps_left, so_far, self.prefix_cache,
+                                                                   self.stats)
+            lookups = dict()  # attainable utilities per distinct attainable set
+            for idx, agent in enumerate(self.agents):
+                if not agent.attainable_Q: continue
+                if id(agent.attainable_Q) not in lookups:
+                    lookups[id(agent.attainable_Q)] = agent.attainable_Q[action_board].max(axis=1), \
+                                                      agent.attainable_Q[inaction_board][:, env.actions['null']]
+                action_attainable, stepwise_null = lookups[id(agent.attainable_Q)]
+                null_attainable = stepwise_null if agent.baseline == 'stepwise' else agent.null
+                penalized[idx] = reward - agent.penalty(action_attainable, null_attainable)
+                self.stats.penalty_evaluations += 1
+            AUPAgent.restart(env, so_far + [action], self.prefix_cache, self.stats)
+        return penalized, time_step.last
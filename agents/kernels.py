@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Numba is optional; without it the NumPy kernels below are used
+    numba = None
+
+# Kernels for the scalar-sized inner loops of tabular learning, over dense state-indexed arrays. Each is written with
+# NumPy and, when Numba is installed, again as compiled loops that replace it. The loops sum in order where NumPy
+# sums pairwise, so both agree to within rounding, as long as scalars are passed in the arrays' dtype.
+
+
+def greedy_action(Q, state):
+    """Action with the largest of Q[state], the first on ties."""
+    return Q[state].argmax()
+
+
+def other_action(greedy, num_actions, draw):
+    """An action other than greedy, chosen uniformly with the [0, 1) draw just as np.random.Generator.choice would
+    with ModelFreeAUPAgent's exploration probabilities."""
+    cdf = np.cumsum([0 if action == greedy else 1.0 / (num_actions - 1) for action in range(num_actions)])
+    cdf /= cdf[-1]
+    return cdf.searchsorted(draw, side='right')
+
+
+def penalty(attainable_Q, state, action, null_action, lambd, use_scale):
+    """ModelFreeAUPAgent's penalty for the action, from attainable_Q[state], of shape [rewards, actions]."""
+    action_attainable, null_attainable = attainable_Q[state, :, action], attainable_Q[state, :, null_action]
+    diff = action_attainable - null_attainable
+    if use_scale:
+        scale = np.sum(abs(null_attainable), axis=-1, keepdims=True)
+        scale[scale == 0] = 1
+        return lambd * np.sum(abs(diff) / scale, axis=-1)
+    scale = np.copy(null_attainable)
+    scale[scale == 0] = 1  # avoid division by zero
+    return lambd * np.average(np.divide(abs(diff), scale), axis=-1)
+
+
+def backup(attainable_Q, attainable_R, AUP_Q, last, action, new, reward, null_action, discount, lambd,
+           learning_rate, use_scale, clip):
+    """ModelFreeAUPAgent's TD update of the whole attainable set and AUP_Q for a transition between state IDs,
+    returning the largest TD error.
+
+    :param attainable_Q: [states, rewards, actions]
+    :param attainable_R: [states, rewards], already looked up for the new state.
+    :param AUP_Q: [states, actions]
+    :param clip: Clip attainable values to [0, 1].
+    """
+    error, AUP_penalty = 0, 0
+    if attainable_Q.shape[1]:
+        attainable_error = attainable_R[new] + discount * attainable_Q[new].max(axis=1) - attainable_Q[last, :, action]
+        attainable_Q[last, :, action] += learning_rate * attainable_error
+        if clip:
+            attainable_Q[last, :, action] = np.clip(attainable_Q[last, :, action], 0, 1)
+        error = abs(attainable_error).max()
+        AUP_penalty = penalty(attainable_Q, last, action, null_action, lambd, use_scale)
+    AUP_error = reward - AUP_penalty + discount * AUP_Q[new].max() - AUP_Q[last, action]
+    AUP_Q[last, action] += learning_rate * AUP_error
+    return float(max(error, abs(AUP_error)))
+
+
+def bellman_sweep(entered, next_nodes, terminal, Q, discount, clip):
+    """One synchronous value iteration sweep over [nodes, actions, rewards] Q-values, returning the new values and
+    the largest change.
+
+    :param entered: [nodes, actions, rewards] reward for the node each action enters.
+    :param next_nodes: [nodes, actions]
+    :param terminal: [nodes] nodes worth nothing, as they are never acted from.
+    """
+    new_Q = entered + discount * Q.max(axis=1)[next_nodes]
+    new_Q[terminal] = 0
+    if clip:
+        np.clip(new_Q, 0, 1, out=new_Q)
+    return new_Q, np.abs(new_Q - Q).max(initial=0)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def greedy_action(Q, state):
+        best = 0
+        for action in range(1, Q.shape[1]):
+            if Q[state, action] > Q[state, best]:
+                best = action
+        return best
+
+    @numba.njit(cache=True)
+    def other_action(greedy, num_actions, draw):
+        cdf = np.empty(num_actions)
+        total = 0.
+        for action in range(num_actions):
+            total += 0. if action == greedy else 1.0 / (num_actions - 1)
+            cdf[action] = total
+        for action in range(num_actions):
+            if cdf[action] / total > draw:
+                return action
+        return num_actions
+
+    @numba.njit(cache=True)
+    def penalty(attainable_Q, state, action, null_action, lambd, use_scale):
+        num_rewards = attainable_Q.shape[1]
+        total, scale = np.zeros(2, attainable_Q.dtype)  # sums in the dtype, as NumPy's
+        if use_scale:
+            for reward in range(num_rewards):
+                scale += abs(attainable_Q[state, reward, null_action])
+            if scale == 0:
+                scale += 1
+            for reward in range(num_rewards):
+                total += abs(attainable_Q[state, reward, action] - attainable_Q[state, reward, null_action]) / scale
+            return lambd * total
+        for reward in range(num_rewards):
+            scale = attainable_Q[state, reward, null_action]
+            if scale == 0:
+                scale += 1  # avoid division by zero
+            total += abs(attainable_Q[state, reward, action] - attainable_Q[state, reward, null_action]) / scale
+        return lambd * (total / num_rewards)
+
+    @numba.njit(cache=True)
+    def backup(attainable_Q, attainable_R, AUP_Q, last, action, new, reward, null_action, discount, lambd,
+               learning_rate, use_scale, clip):
+        error, AUP_penalty = 0., reward - reward
+        num_rewards, num_actions = attainable_Q.shape[1], attainable_Q.shape[2]
+        for rewarded in range(num_rewards):
+            best = attainable_Q[new, rewarded, 0]
+            for other in range(1, num_actions):
+                best = max(best, attainable_Q[new, rewarded, other])
+            attainable_error = attainable_R[new, rewarded] + discount * best - attainable_Q[last, rewarded, action]
+            attainable_Q[last, rewarded, action] += learning_rate * attainable_error
+            if clip:
+                attainable_Q[last, rewarded, action] = min(max(attainable_Q[last, rewarded, action], 0), 1)
+            error = max(error, abs(attainable_error))
+        if num_rewards:
+            AUP_penalty = penalty(attainable_Q, last, action, null_action, lambd, use_scale)
+        best = AUP_Q[new, 0]
+        for other in range(1, num_actions):
+            best = max(best, AUP_Q[new, other])
+        AUP_error = reward - AUP_penalty + discount * best - AUP_Q[last, action]
+        AUP_Q[last, action] += learning_rate * AUP_error
+        return max(error, abs(AUP_error))
+
+    @numba.njit(cache=True)
+    def bellman_sweep(entered, next_nodes, terminal, Q, discount, clip):
+        num_nodes, num_actions, num_rewards = Q.shape
+        values = np.empty((num_nodes, num_rewards))
+        for node in range(num_nodes):
+            for reward in range(num_rewards):
+                values[node, reward] = Q[node, 0, reward]
+                for action in range(1, num_actions):
+                    values[node, reward] = max(values[node, reward], Q[node, action, reward])
+        new_Q, change = np.zeros_like(Q), 0.
+        for node in range(num_nodes):
+            for action in range(num_actions):
+                for reward in range(num_rewards):
+                    value = 0. if terminal[node] \
+                        else entered[node, action, reward] + discount * values[next_nodes[node, action], reward]
+                    if clip:
+                        value = min(max(value, 0.), 1.)
+                    new_Q[node, action, reward] = value
+                    change = max(change, abs(value - Q[node, action, reward]))
+        return new_Q, change
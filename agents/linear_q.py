@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import numpy as np
+
+
+class LinearAttainableQ():
+    """
+    Attainable Q-functions approximated linearly in binary features of the board: which object code is in each cell,
+    which codes are in each coarse tile of cells, and a bias. The weights are shared by all states and only the
+    recent boards' features are kept, so memory is set by the board size however many states are visited. Reads like
+    a tabular attainable_Q: indexing by board string gives its [rewards, actions] Q-values.
+
+    Features come from the board arrays handed to observe(). Boards whose features have since been dropped are
+    parsed back out of their strings, so those must print every cell.
+    """
+
+    def __init__(self, index, board_shape, num_rewards, num_actions, num_codes=16, tile_size=2, step_size=.5,
+                 clip=False, recent=64, dtype=float):
+        """
+        :param index: StateIndex whose state IDs update() takes.
+        :param board_shape: Shape of the board arrays behind the board strings.
+        :param num_rewards:
+        :param num_actions:
+        :param num_codes: Object codes told apart; larger codes share the last one's features.
+        :param tile_size: Side of the square tiles of cells.
+        :param step_size: Fraction of the TD error each update corrects for the updated state.
+        :param clip: Clip Q-values to [0, 1], as for state indicator rewards.
+        :param recent: How many boards' features to keep around.
+        :param dtype: Of the weights.
+        """
+        self.index, self.shape = index, (num_rewards, num_actions)
+        self.num_codes, self.step_size, self.clip = num_codes, step_size, clip
+        rows, cols = np.indices(board_shape)
+        self.tiles = ((rows // tile_size) * -(-board_shape[1] // tile_size) + cols // tile_size).ravel()
+        self.num_cells = rows.size
+        num_features = (self.num_cells + self.tiles.max() + 1) * num_codes + 1
+        self.weights = np.zeros((num_features,) + self.shape, dtype=dtype)
+        self.recent, self.capacity = OrderedDict(), recent
+
+    def observe(self, board, board_array):
+        """Compute the features of a board string from the board array behind it, if they aren't at hand."""
+        if board in self.recent:
+            self.recent.move_to_end(board)
+        else:
+            self.remember(board, self.active(np.ravel(board_array).astype(int)))
+
+    def parse(self, board):
+        """The codes of a board string, one per cell."""
+        if '...' in board:
+            raise ValueError("Can't parse a board string np.array2string summarized; print it with "
+                             "threshold=board.size.")
+        return np.array(board.replace('[', ' ').replace(']', ' ').split(), dtype=float).astype(int)
+
+    def features(self, board):
+        """Indices of the board's active features."""
+        active = self.recent.get(board)
+        if active is not None:
+            self.recent.move_to_end(board)
+            return active
+        return self.remember(board, self.active(self.parse(board)))
+
+    def active(self, codes):
+        """Indices of the active features of a board's codes, one per cell."""
+        if codes.size != self.num_cells:
+            raise ValueError("A board of {} cells doesn't fit board_shape, of {}.".format(codes.size, self.num_cells))
+        codes = np.minimum(codes, self.num_codes - 1)
+        cells = np.flatnonzero(codes)
+        return np.concatenate([cells * self.num_codes + codes[cells],
+                               np.unique((self.num_cells + self.tiles[cells]) * self.num_codes + codes[cells]),
+                               [len(self.weights) - 1]])
+
+    def remember(self, board, active):
+        """Keep the board's features among the recent ones, returning them."""
+        self.recent[board] = active
+        if len(self.recent) > self.capacity:
+            self.recent.popitem(last=False)
+        return active
+
+    def __getitem__(self, board):
+        Q = self.weights[self.features(board)].sum(axis=0)
+        return np.clip(Q, 0, 1) if self.clip else Q
+
+    def __bool__(self):
+        return all(self.shape)
+
+    def state(self, state):
+        """Q-values of the state with the given ID."""
+        return self[self.index.boards[state]]
+
+    def update(self, state, action, errors, rewards=slice(None)):
+        """Semi-gradient step on the weights of the state's features, for the action and the given reward functions.
+
+        :param state: State ID.
+        :param action:
+        :param errors: TD error for each of the reward functions.
+        :param rewards: Which reward functions, as a slice or index array.
+        """
+        active = self.features(self.index.boards[state])
+        rewards = np.arange(self.shape[0])[rewards]
+        self.weights[active[:, None], rewards, action] += self.step_size * errors / len(active)
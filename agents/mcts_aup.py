@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import math
+import time
+import numpy as np
+from agents.aup import AUPAgent, PlannerStats
+
+
+class MCTSAUPAgent(AUPAgent):
+    """
+    Attainable utility-preserving agent that plans with Monte Carlo tree search (UCT) on the penalized reward, for
+    levels and horizons too large for the exhaustive search.
+    """
+
+    class Node():
+        __slots__ = ('reward', 'done', 'visits', 'total', 'children')
+
+        def __init__(self, reward=0, done=False):
+            self.reward, self.done = reward, done  # of the action leading here
+            self.visits, self.total = 0, 0.  # total is summed over the returns following this node
+            self.children = dict()
+
+        def value(self, discount):
+            return self.reward + discount * self.total / self.visits
+
+    def __init__(self, attainable_Q, simulations=200, exploration=1., leaf_Q=None, **kwargs):
+        """
+        :param attainable_Q: Q functions for the attainable set.
+        :param simulations: Simulation budget per planned step.
+        :param exploration: UCT exploration constant.
+        :param leaf_Q: Q functions whose max at a leaf estimates its value, e.g. attainable_Q (averaged over the
+                       attainable set). Leaves are worth nothing if not given.
+        :param kwargs: Penalty and caching options, as for AUPAgent.
+        """
+        super().__init__(attainable_Q, **kwargs)
+        self.name = 'MCTS ' + self.name
+        self.simulations = simulations
+        self.exploration = exploration
+        self.leaf_Q = leaf_Q
+
+    def get_actions(self, env, steps_left, so_far=[]):
+        """Plan one step at a time, keeping the chosen subtree for the next step, and return the plan and its return.
+        :param env: Simulator.
+        :param steps_left: How many steps to plan over.
+        :param so_far: Actions taken up until now.
+        """
+        self.stats = PlannerStats()
+        self.prefix_cache.clear()
+        self.set_baseline(env, steps_left)
+
+        root, plan, ret = self.Node(), list(so_far), 0
+        for step in range(steps_left):
+            start = time.perf_counter()
+            for _ in range(self.simulations):
+                self.simulate(env, root, plan, steps_left - step)
+            self.stats.depth_time[step] += time.perf_counter() - start
+            if not root.children: break
+            action = max(root.children, key=lambda a: root.children[a].visits)
+            root = root.children[action]
+            ret += self.discount ** step * root.reward
+            plan.append(action)
+            if root.done: break
+
+        self.restart(env, so_far, self.prefix_cache, self.stats)
+        return plan[len(so_far):], ret
+
+    def simulate(self, env, node, so_far, steps_left):
+        """Run one selection, expansion, evaluation and backup pass from the node reached by so_far."""
+        path, actions = [node], list(so_far)
+        while steps_left > 0 and not node.done and len(node.children) == len(env.actions):
+            action = self.select(node)
+            node = node.children[action]
+            path.append(node)
+            actions.append(action)
+            steps_left -= 1
+
+        value = 0
+        if steps_left > 0 and not node.done:
+            action = next(a for a in range(len(env.actions)) if a not in node.children)
+            self.restart(env, actions, self.prefix_cache, self.stats)
+            self.stats.nodes_expanded += 1
+            node.children[action] = self.Node(*self.penalized_reward(env, action, steps_left, actions))
+            node = node.children[action]
+            path.append(node)
+            if steps_left > 1 and not node.done:
+                value = self.leaf_value(env)
+
+        for node in reversed(path):
+            node.visits += 1
+            node.total += value
+            value = node.reward + self.discount * value
+
+    def select(self, node):
+        """The child action maximizing the UCT score."""
+        log_visits = math.log(node.visits)
+        return max(node.children, key=lambda a: node.children[a].value(self.discount) +
+                   self.exploration * math.sqrt(log_visits / node.children[a].visits))
+
+    def leaf_value(self, env):
+        """Estimated return from the current state onwards."""
+        if self.leaf_Q is None: return 0
+        return np.max(self.leaf_Q[str(env.get_obs()['board'])], axis=-1).mean()
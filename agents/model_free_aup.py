@@ -1,15 +1,32 @@
 from collections import defaultdict
+from multiprocessing import Array, Pool, Process, Queue, Value, shared_memory
+import heapq
+import json
+import os
+import queue
+import time
 import experiments.env_helper as env_helper
 import numpy as np
+import agents.kernels as kernels
+from agents.linear_q import LinearAttainableQ
+from agents.tables import StateIndex, SharedStateIndex, DenseQ, check_precision
+from agents.value_iteration import solve_attainable_Q, reward_matrix
 
 
 class ModelFreeAUPAgent:
     name = "Model-free AUP"
     pen_epsilon, AUP_epsilon = .2, .9  # chance of choosing greedy action in training
+    sweep_threshold = 1e-6  # smallest TD error worth queueing for prioritized sweeping
+    heads = ()  # shape of the axes AUP_Q has between states and actions, for learning several AUP_Qs at once
+    attainable_heads = ()  # likewise for the axes attainable_Q has between states and reward functions
     default = {'lambd': 1./1.501, 'discount': .996, 'rpenalties': 30, 'episodes': 60} #6000}
 
     def __init__(self, env, lambd=default['lambd'], state_attainable=False, num_rewards=default['rpenalties'],
-                 discount=default['discount'], episodes=default['episodes'], trials=50, use_scale=False):
+                 discount=default['discount'], episodes=default['episodes'], trials=50, use_scale=False, seed=None,
+                 workers=1, batched=False, eval_every=10, fast_eval=False, checkpoint_dir=None, checkpoint_every=500,
+                 warm_start=False, planning_steps=0, prioritized=False, td_tolerance=None, td_window=10,
+                 stable_evals=None, telemetry=None, penalty_samples=None, attainable_backend='table', hogwild=False,
+                 hogwild_capacity=1 << 16, dtype=np.float32, use_kernels=None):
         """Trains using the simulator and e-greedy exploration to determine a greedy policy.
 
         :param env: Simulator.
@@ -19,6 +36,48 @@ class ModelFreeAUPAgent:
         :param discount:
         :param episodes:
         :param trials:
+        :param seed: Master seed. Each trial draws its exploration and random rewards from its own stream spawned
+                     from it, so results don't depend on the number of workers.
+        :param workers: Processes to run trials in. Leave at 1 when already inside a pool worker.
+        :param batched: Train all trials together in lockstep over the env's compiled transition table.
+        :param eval_every: Episodes between evaluations of the greedy policy for performance. 0 only evaluates once,
+                           after training.
+        :param fast_eval: Evaluate by rolling out over the env's compiled transition table rather than running (and
+                          rendering) a full episode in the env. Batched training always does.
+        :param checkpoint_dir: Directory to checkpoint each trial's progress in. Trials found there resume where
+                               they stopped, if saved with the same configuration; use one directory per
+                               configuration. Needs a seed, so that resumed trials draw the same random rewards.
+        :param checkpoint_every: Episodes between checkpoints.
+        :param warm_start: Start each trial's attainable Q-functions at their values solved by value iteration over
+                           the env's compiled transition table, so that training mostly has to learn AUP_Q. They are
+                           only approximate where boards hide state; see solve_attainable_Q.
+        :param planning_steps: Dyna-Q backups of every Q-function per env step, replaying transitions remembered from
+                               earlier steps. The envs are deterministic, so one visit is enough to remember one.
+        :param prioritized: Choose the planning backups by prioritized sweeping on TD error instead of at random.
+        :param td_tolerance: Stop a trial early once no TD error of its last td_window episodes reached this.
+        :param td_window:
+        :param stable_evals: Stop a trial early once this many evaluations in a row found the same greedy policy.
+                             With td_tolerance also given, both must hold. Later evaluations repeat the last one.
+        :param telemetry: Called with a dict of FIELDS from agents.telemetry at the end of every trial's every episode,
+                          e.g. a JSONLSink or CSVSink. Batched training charges each trial an equal share of each
+                          lockstep's time.
+        :param penalty_samples: Update, and estimate the penalty from, only this many reward functions of the
+                                attainable set per step, drawn at random. The sample average is an unbiased estimate
+                                of the average penalty. With use_scale, the scale is still summed over the whole set,
+                                and the sample's differences are scaled up by the set's size over the sample's, which
+                                is unbiased too.
+        :param attainable_backend: 'table' - tabular attainable Q-functions; 'linear' - LinearAttainableQ, which keeps
+                                   nothing per state beyond AUP_Q's row, for large levels.
+        :param hogwild: Train each trial with workers processes that share its Q-functions and update them without
+                        locking, Hogwild-style, rather than running trials in parallel. States are numbered as the
+                        workers first see them.
+        :param hogwild_capacity: Most states Hogwild training can number, as its shared tables are allocated up front.
+        :param dtype: Floating point dtype of the Q-functions and rewards, and so of the penalties computed from
+                      them. Warns if it is too coarse for the discount; float16 is, at the default discount.
+        :param use_kernels: Run backups, penalties and e-greedy choices through agents.kernels, compiled by Numba if
+                            it is installed, for the same results up to rounding at a fraction of the Python
+                            overhead. Only for float32 or float64 tabular attainable Q-functions and a single AUP_Q,
+                            without penalty sampling. None uses them whenever Numba is installed and they apply.
         """
         self.actions = range(len(env.actions))
         self.probs = [[1.0 / (len(self.actions) - 1) if i != k else 0 for i in self.actions] for k in self.actions]
@@ -28,99 +87,687 @@ class ModelFreeAUPAgent:
         self.lambd = lambd
         self.state_attainable = state_attainable
         self.use_scale = use_scale
+        self.seed = seed
+        self.workers = workers
+        self.batched = batched
+        self.eval_every = eval_every
+        self.fast_eval = fast_eval
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.warm_start = warm_start
+        self.planning_steps = planning_steps
+        self.prioritized = prioritized
+        if batched and checkpoint_dir is not None:
+            raise ValueError("Batched training does not support checkpointing.")
+        if checkpoint_dir is not None and seed is None:
+            raise ValueError("Checkpointing needs a seed to resume trials exactly.")
+        if batched and planning_steps:
+            raise ValueError("Batched training does not support planning.")
+        if attainable_backend not in ('table', 'linear'):
+            raise ValueError("Unknown attainable_backend {}.".format(attainable_backend))
+        if attainable_backend == 'linear' and (batched or warm_start):
+            raise ValueError("Batched training and warm starts need the table backend.")
+        if hogwild and (batched or checkpoint_dir is not None or attainable_backend != 'table'
+                        or td_tolerance is not None or stable_evals is not None):
+            raise ValueError("Hogwild training does not support batching, checkpoints, the linear backend or early "
+                             "stopping.")
+        if stable_evals is not None and not eval_every:
+            raise ValueError("Stopping on a stable policy needs eval_every.")
+        self.td_tolerance = td_tolerance
+        self.td_window = td_window
+        self.stable_evals = stable_evals
+        self.telemetry = telemetry
+        self.attainable_backend = attainable_backend
+        self.hogwild = hogwild
+        self.hogwild_capacity = hogwild_capacity
+        self.dtype = np.dtype(dtype)
+        for gamma in np.ravel(discount):  # sweeps learn with several
+            check_precision(self.dtype, gamma)
         self.null_action = env.actions['null']
 
         if state_attainable:
             self.name = 'Relative reachability'
             self.attainable_set = env_helper.derive_possible_rewards(env)
         else:
-            self.attainable_set = [defaultdict(np.random.random) for _ in range(num_rewards)]
+            self.attainable_set = env_helper.RandomRewards(num_rewards, seed)
 
         if len(self.attainable_set) == 0:
             self.name = 'Standard'  # no penalty applied!
+        self.penalty_samples = penalty_samples if penalty_samples is not None \
+            and penalty_samples < len(self.attainable_set) else None  # sampling everything is the same as not
+        supported = attainable_backend == 'table' and self.penalty_samples is None and not self.heads \
+            and not self.attainable_heads and np.ndim(lambd) == 0 and np.ndim(discount) == 0 \
+            and self.dtype in (np.float32, np.float64)  # Numba has no float16
+        if use_kernels and not supported:
+            raise ValueError("Kernels only run float32 or float64 tabular attainable Q-functions and a single AUP_Q, "
+                             "without penalty sampling.")
+        self.use_kernels = supported and kernels.numba is not None if use_kernels is None else use_kernels
 
         self.train(env)
         print("trained")
 
     def train(self, env):
-        self.performance = np.zeros((self.trials, int(self.episodes / 10)))
+        self.performance = np.zeros((self.trials, self.num_evaluations()) + self.heads)
+        self.transitions = env_helper.compile_transitions(env) if self.fast_eval or self.warm_start else None
 
         # 0: high-impact, incomplete; 1: high-impact, complete; 2: low-impact, incomplete; 3: low-impact, complete
-        self.counts = np.zeros(4)
-
-        for trial in range(self.trials):
-            self.attainable_Q = defaultdict(lambda: np.zeros((len(self.attainable_set), len(self.actions))))
-            self.AUP_Q = defaultdict(lambda: np.zeros(len(self.actions)))
-            if not self.state_attainable:
-                self.attainable_set = [defaultdict(np.random.random) for _ in range(len(self.attainable_set))]
-            self.epsilon = self.pen_epsilon
-
-            for episode in range(self.episodes):
-                if episode > 2.0 / 3 * self.episodes:  # begin greedy exploration
-                    self.epsilon = self.AUP_epsilon
-                time_step = env.reset()
-                while not time_step.last:
-                    last_board = str(env.get_obs()['board'])
-                    action = self.behavior_action(last_board)
-                    time_step = env.step(action)
-                    self.update_greedy(last_board, action, time_step)
-                if episode % 10 == 0:
-                    _, actions, self.performance[trial][int(episode / 10)], _ = env_helper.run_episode(self, env)
-            self.counts[int(self.performance[trial, -1]) + 2] += 1  # -2 goes to idx 0
+        self.counts = np.zeros(self.heads + (4,))
+        self.stopping_episodes = np.full(self.trials, self.episodes)  # episodes each trial trained for
+
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(self.trials)
+        if self.batched:
+            self.train_batched(env, seed_sequences)
+        elif self.hogwild:
+            for trial, seed_sequence in enumerate(seed_sequences):
+                self.performance[trial] = self.run_trial_hogwild(env, trial, seed_sequence)
+        elif self.workers > 1:
+            with Pool(self.workers) as pool:
+                results = pool.starmap(train_trial, [(self, env, trial, seed_sequence, trial == self.trials - 1)
+                                                     for trial, seed_sequence in enumerate(seed_sequences)])
+            for trial, (performance, stopping_episode, learned) in enumerate(results):
+                self.performance[trial], self.stopping_episodes[trial] = performance, stopping_episode
+            self.__dict__.update(learned)  # keep the last trial's functions, as sequential training does
+        else:
+            for trial, seed_sequence in enumerate(seed_sequences):
+                self.performance[trial] = self.run_trial(env, trial, seed_sequence)
+                self.stopping_episodes[trial] = self.stopping_episode
+
+        outcomes = self.performance[:, -1].astype(int) + 2  # -2 goes to idx 0
+        self.counts += (outcomes[..., None] == np.arange(4)).sum(axis=0)
 
         env.reset()
 
+    def num_evaluations(self):
+        return -(-self.episodes // self.eval_every) if self.eval_every else 1
+
+    def run_trial(self, env, trial, seed_sequence):
+        """Learn from scratch (or from the trial's checkpoint) for one trial, returning the performance measured
+        every eval_every episodes. The number of episodes trained for is left in stopping_episode.
+
+        :param env: Simulator.
+        :param trial: Number of the trial, naming its checkpoint.
+        :param seed_sequence: Seeds the trial's exploration and random rewards, through independent children.
+        """
+        performance = np.zeros((self.num_evaluations(),) + self.heads)
+        explore_seed, rewards_seed = trial_seeds(seed_sequence)
+        self.rng = np.random.default_rng(explore_seed)
+
+        # Dense tables over one shared state numbering; both still read like dicts keyed by board. Boards of the
+        # transition table come first, so that its state IDs index the tables directly.
+        self.index = StateIndex(self.transitions.index.boards if self.transitions is not None else ())
+        if self.attainable_backend == 'linear':
+            self.attainable_Q = LinearAttainableQ(self.index, (env.size, env.size), len(self.attainable_set),
+                                                  len(self.actions), clip=self.state_attainable, dtype=self.dtype)
+            self.attainable_R = None  # looked up on demand, so that memory doesn't grow with the states
+        else:
+            shape = self.attainable_heads + (len(self.attainable_set), len(self.actions))
+            self.attainable_Q = DenseQ(self.index, shape, dtype=self.dtype)
+            self.attainable_R = DenseQ(self.index, (len(self.attainable_set),), dtype=self.dtype,
+                                       fill=np.nan)  # NaN until looked up
+        self.AUP_Q = DenseQ(self.index, self.heads + (len(self.actions),), dtype=self.dtype)
+        if not self.state_attainable:
+            self.attainable_set = env_helper.RandomRewards(len(self.attainable_set), rewards_seed)
+        if self.warm_start and len(self.attainable_set):
+            rewards = np.array([self.attainable_rewards(state, board)
+                                for state, board in enumerate(self.transitions.index.boards)])
+            self.attainable_Q.values[:len(rewards)] = self.solve_attainable(rewards)
+        self.model, self.predecessors, self.queue = dict(), defaultdict(list), []
+        self.remembered = []  # the model's keys, to sample planning replays from
+        self.td_errors = np.full(self.td_window, np.nan)  # largest TD error of recent episodes
+        self.policy, self.unchanged = np.zeros(0, dtype=int), 0  # greedy policy at the last evaluations, and how many
+        self.stopping_episode = self.episodes
+        self.epsilon = self.pen_epsilon
+        start = self.load_checkpoint(trial, performance)
+
+        for episode in range(start, self.stopping_episode):
+            if episode > 2.0 / 3 * self.episodes:  # begin greedy exploration
+                self.epsilon = self.AUP_epsilon
+            episode_start = time.perf_counter()
+            steps, error, env_time, update_time = self.train_episode(env)
+            self.td_errors[episode % self.td_window] = error
+            eval_start = time.perf_counter()
+            if self.eval_every and episode % self.eval_every == 0:
+                performance[episode // self.eval_every] = self.evaluate(env)
+                policy = self.AUP_Q.values[:len(self.index)].argmax(axis=-1)
+                self.unchanged = self.unchanged + 1 if np.array_equal(policy, self.policy) else 1
+                self.policy = policy
+
+            stop = self.converged(self.td_errors, self.unchanged)
+            if stop:
+                self.stopping_episode = episode + 1
+                if self.eval_every:
+                    performance[-(-self.stopping_episode // self.eval_every):] = self.evaluate(env)
+            end = time.perf_counter()
+            self.report(trial, episode, steps, end - episode_start, env_time, update_time, end - eval_start,
+                        len(self.index))
+            if stop or (episode + 1) % self.checkpoint_every == 0 or episode + 1 == self.episodes:
+                self.save_checkpoint(trial, episode + 1, performance)
+            if stop: break
+        if not self.eval_every:
+            performance[0] = self.evaluate(env)
+        return performance
+
+    def train_episode(self, env):
+        """Run an e-greedy training episode, returning its steps, largest TD error, and time spent stepping the env
+        and updating.
+        """
+        time_step, error = env.reset(), 0
+        steps, env_time, update_time = 0, 0., 0.
+        while not time_step.last:
+            start = time.perf_counter()
+            last_board = str(env.get_obs()['board'])
+            if self.attainable_backend == 'linear':  # its features come from the board arrays behind the strings
+                self.attainable_Q.observe(last_board, env.get_board())
+            action = self.behavior_action(last_board)
+            time_step = env.step(action)
+            stepped = time.perf_counter()
+            if self.attainable_backend == 'linear':
+                self.attainable_Q.observe(str(time_step.observation['board']), env.get_board())
+            error = max(error, self.update_greedy(last_board, action, time_step))
+            env_time, update_time = env_time + stepped - start, update_time + time.perf_counter() - stepped
+            steps += 1
+        return steps, error, env_time, update_time
+
+    def run_trial_hogwild(self, env, trial, seed_sequence):
+        """Learn one trial with workers processes, each running its own copy of the env, that update Q arrays in
+        shared memory without locking. States are numbered as the workers first see them, into tables of
+        hogwild_capacity states allocated up front, and each worker evaluates a snapshot of the greedy policy when it
+        finishes an episode due for evaluation. Returns the performance as run_trial does.
+
+        :param env: Simulator.
+        :param trial: Number of the trial.
+        :param seed_sequence: Seeds the trial's random rewards and its workers' exploration, through independent
+            children.
+        """
+        num_rewards, num_actions = len(self.attainable_set), len(self.actions)
+        performance = np.zeros(self.num_evaluations())
+        explore_seed, rewards_seed = trial_seeds(seed_sequence)
+        if not self.state_attainable:
+            self.attainable_set = env_helper.RandomRewards(num_rewards, rewards_seed)
+
+        index = SharedStateIndex(self.hogwild_capacity)
+        shapes = [(self.hogwild_capacity, num_actions), (self.hogwild_capacity, num_rewards, num_actions),
+                  (self.hogwild_capacity, num_rewards)]
+        blocks = [shared_memory.SharedMemory(create=True, size=max(self.dtype.itemsize * int(np.prod(shape)), 8))
+                  for shape in shapes]
+        try:
+            AUP_Q, attainable_Q, attainable_R = [np.ndarray(shape, dtype=self.dtype, buffer=block.buf)
+                                                 for block, shape in zip(blocks, shapes)]
+            AUP_Q[:], attainable_Q[:], attainable_R[:] = 0, 0, np.nan  # rewards NaN until looked up
+            if self.transitions is not None:  # its boards come first, so that its state IDs index the tables
+                for board in self.transitions.index.boards:
+                    index[board]
+            if self.warm_start and num_rewards:
+                rewards = reward_matrix(self.attainable_set, self.transitions.index)
+                attainable_R[:len(rewards)] = rewards
+                attainable_Q[:len(rewards)] = solve_attainable_Q(self.transitions, rewards, self.discount,
+                                                                 clip=self.state_attainable).values
+
+            claimed = Value('l', 0)  # episodes started
+            evaluations, numbered = Array('d', len(performance), lock=False), Queue()
+            workers = [Process(target=hogwild_worker, args=(self, env, trial, index, blocks, shapes, worker_seed,
+                                                            claimed, evaluations, numbered))
+                       for worker_seed in explore_seed.spawn(self.workers)]
+            for worker in workers:
+                worker.start()
+            boards, pending = index.numbered + [None] * (self.hogwild_capacity - len(index.numbered)), len(workers)
+            while pending:  # drained before joining, as a worker can't exit while its queue is full
+                try:
+                    for state, board in numbered.get(timeout=.1):
+                        boards[state] = board
+                    pending -= 1
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers): break  # killed without reporting
+            for worker in workers:
+                worker.join()
+            if any(worker.exitcode for worker in workers):
+                raise RuntimeError("A Hogwild worker failed.")
+            performance[:] = evaluations
+
+            self.index = StateIndex(boards[:len(index)])
+            num_states = len(self.index)
+            self.AUP_Q = DenseQ(self.index, (num_actions,), values=AUP_Q[:num_states].copy())
+            self.attainable_Q = DenseQ(self.index, (num_rewards, num_actions), values=attainable_Q[:num_states].copy())
+            self.attainable_R = DenseQ(self.index, (num_rewards,), values=attainable_R[:num_states].copy(),
+                                       fill=np.nan)
+            if not self.eval_every:
+                performance[0] = self.evaluate(env)
+        finally:
+            AUP_Q = attainable_Q = attainable_R = None  # release the buffers before closing them
+            for block in blocks:
+                block.close()
+                block.unlink()
+            index.close(unlink=True)
+        return performance
+
+    def report(self, trial, episode, steps, wall_time, env_time, update_time, eval_time, states):
+        """Send an episode's telemetry to the telemetry callback, if there is one."""
+        if self.telemetry is None: return
+        greedy = episode > 2.0 / 3 * self.episodes
+        self.telemetry({'trial': int(trial), 'episode': int(episode), 'steps': int(steps),
+                        'steps_per_second': steps / wall_time if wall_time else 0., 'wall_time': float(wall_time),
+                        'env_time': float(env_time), 'update_time': float(update_time), 'eval_time': float(eval_time),
+                        'states': int(states), 'epsilon': self.AUP_epsilon if greedy else self.pen_epsilon,
+                        'phase': 'greedy' if greedy else 'explore'})
+
+    def converged(self, td_errors, unchanged):
+        """Whether training can stop, given the largest TD error of each of the last td_window episodes (NaN for
+        those not yet run) and for how many evaluations in a row the greedy policy stayed the same. Works over
+        leading trial axes.
+        """
+        converged = np.full(np.shape(unchanged), self.td_tolerance is not None or self.stable_evals is not None)
+        if self.td_tolerance is not None:
+            converged &= np.max(td_errors, axis=-1) < self.td_tolerance
+        if self.stable_evals is not None:
+            converged &= unchanged >= self.stable_evals
+        return converged
+
+    def checkpoint_path(self, trial):
+        return os.path.join(self.checkpoint_dir, 'trial-{}.npz'.format(trial))
+
+    def checkpoint_config(self):
+        """The settings a checkpoint must have been saved with to be resumed, as a JSON string."""
+        config = dict(episodes=self.episodes, seed=self.seed, dtype=self.dtype.name, lambd=np.asarray(self.lambd),
+                      discount=np.asarray(self.discount), state_attainable=self.state_attainable,
+                      num_rewards=len(self.attainable_set), use_scale=self.use_scale, eval_every=self.eval_every,
+                      planning_steps=self.planning_steps, prioritized=self.prioritized,
+                      penalty_samples=self.penalty_samples, attainable_backend=self.attainable_backend,
+                      attainable_shape=self.attainable_Q.shape, AUP_shape=self.AUP_Q.shape,
+                      td_tolerance=self.td_tolerance, td_window=self.td_window, stable_evals=self.stable_evals)
+        return json.dumps(config, sort_keys=True, default=lambda value: value.tolist() if isinstance(value, np.ndarray)
+                          else str(value))
+
+    def save_checkpoint(self, trial, episodes_done, performance):
+        """Save everything the trial needs to resume after the given number of episodes."""
+        if self.checkpoint_dir is None: return
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        num_states = len(self.index)
+        path = self.checkpoint_path(trial)
+        with open(path + '.tmp', 'wb') as f:  # replace the old checkpoint only once the new one is complete
+            np.savez(f, config=self.checkpoint_config(), episodes_done=episodes_done, performance=performance,
+                     boards=np.array(self.index.boards, dtype=str), AUP_Q=self.AUP_Q.values[:num_states],
+                     attainable_Q=self.attainable_Q.weights if self.attainable_backend == 'linear'
+                     else self.attainable_Q.values[:num_states],
+                     attainable_R=self.attainable_R.values[:num_states] if self.attainable_R is not None
+                     else np.zeros((0, 0)),
+                     rng_state=json.dumps(self.rng.bit_generator.state), td_errors=self.td_errors,
+                     policy=self.policy, unchanged=self.unchanged, stopping_episode=self.stopping_episode,
+                     model=np.array([key + value for key, value in self.model.items()], dtype=float).reshape(-1, 4),
+                     predecessors=np.array([(new,) + key for new, keys in self.predecessors.items() for key in keys],
+                                           dtype=int).reshape(-1, 3),
+                     queue=np.array([(priority,) + key for priority, key in self.queue], dtype=float).reshape(-1, 3))
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, trial, performance):
+        """Restore the trial's checkpoint if there is one, returning the episode to continue from."""
+        if self.checkpoint_dir is None or not os.path.exists(self.checkpoint_path(trial)): return 0
+        with np.load(self.checkpoint_path(trial)) as checkpoint:
+            if 'config' not in checkpoint or str(checkpoint['config']) != self.checkpoint_config():
+                raise ValueError("{} was saved with a different configuration; resume it with the same settings, or "
+                                 "use another checkpoint_dir.".format(self.checkpoint_path(trial)))
+            self.index = StateIndex(checkpoint['boards'].tolist())
+            self.AUP_Q = DenseQ(self.index, self.AUP_Q.shape, values=checkpoint['AUP_Q'].astype(self.dtype))
+            if self.attainable_backend == 'linear':
+                self.attainable_Q.index = self.index
+                self.attainable_Q.weights = checkpoint['attainable_Q'].astype(self.dtype)
+            else:
+                self.attainable_Q = DenseQ(self.index, self.attainable_Q.shape,
+                                           values=checkpoint['attainable_Q'].astype(self.dtype))
+                self.attainable_R = DenseQ(self.index, self.attainable_R.shape,
+                                           values=checkpoint['attainable_R'].astype(self.dtype), fill=np.nan)
+            self.rng.bit_generator.state = json.loads(str(checkpoint['rng_state']))
+            performance[:] = checkpoint['performance']
+            episodes_done = int(checkpoint['episodes_done'])
+            self.td_errors, self.policy = checkpoint['td_errors'], checkpoint['policy']
+            self.unchanged, self.stopping_episode = int(checkpoint['unchanged']), int(checkpoint['stopping_episode'])
+            self.model = {(int(last), int(action)): (int(new), float(reward))  # rewards as observed, not np.float64
+                          for last, action, new, reward in checkpoint['model']}
+            self.remembered = list(self.model)
+            for new, last, action in checkpoint['predecessors'].tolist():
+                self.predecessors[new].append((last, action))
+            self.queue = [(priority, (int(last), int(action))) for priority, last, action in checkpoint['queue']]
+        return episodes_done
+
+    def evaluate(self, env):
+        """The hidden reward of following the greedy policy for an episode."""
+        if self.fast_eval:
+            return self.transitions.greedy_hidden_reward(np.moveaxis(self.AUP_Q.values, 0, -2))
+        _, actions, performance, _ = env_helper.run_episode(self, env)
+        return performance
+
+    def train_batched(self, env, seed_sequences):
+        """Train every trial at once: Q arrays carry a leading trials axis, and all trials' episodes step in lockstep
+        over the env's compiled transition table, restarting as they finish. Trials have the random rewards
+        sequential training would give them, but all explore with one random stream seeded by seed, so results match
+        sequential training in distribution rather than exactly.
+
+        :param env: Simulator.
+        :param seed_sequences: Each trial's seed.
+        """
+        learning_rate = 1
+        table = env_helper.compile_transitions(env)
+        rng = np.random.default_rng(self.seed)
+        num_states, num_rewards, num_actions = len(table.index), len(self.attainable_set), len(self.actions)
+
+        AUP_Q = np.zeros((self.trials, num_states, num_actions), dtype=self.dtype)
+        attainable_Q = np.zeros((self.trials, num_states, num_rewards, num_actions), dtype=self.dtype)
+        if self.state_attainable:
+            rewards = np.broadcast_to(reward_matrix(self.attainable_set, table.index).astype(self.dtype),
+                                      (self.trials, num_states, num_rewards))
+        else:
+            rewards = np.array([reward_matrix(env_helper.RandomRewards(num_rewards, trial_seeds(seed_sequence)[1]),
+                                              table.index)
+                                for seed_sequence in seed_sequences],
+                               dtype=self.dtype).reshape(self.trials, num_states, num_rewards)
+        if self.warm_start and num_rewards:
+            # Solve every trial's attainable set in one go, as columns of a single reward matrix
+            distinct = rewards[:1] if self.state_attainable else rewards
+            solved = solve_attainable_Q(table, distinct.transpose(1, 0, 2).reshape(num_states, -1), self.discount,
+                                        clip=self.state_attainable).values
+            attainable_Q[:] = solved.reshape(num_states, len(distinct), num_rewards, num_actions).transpose(1, 0, 2, 3)
+
+        nodes, episodes = np.zeros(self.trials, dtype=int), np.zeros(self.trials, dtype=int)
+        errors, td_errors = np.zeros(self.trials), np.full((self.trials, self.td_window), np.nan)
+        policies, unchanged = np.full((self.trials, num_states), -1), np.zeros(self.trials, dtype=int)
+        running = np.ones(self.trials, dtype=bool)
+        steps, times = np.zeros(self.trials, dtype=int), np.zeros((self.trials, 3))  # env, update and eval time
+        seen = np.zeros((self.trials, num_states), dtype=bool)
+        seen[:, table.state_ids[0]] = True
+        active = np.arange(self.trials)
+        while len(active):
+            start = time.perf_counter()
+            node = nodes[active]
+            state = table.state_ids[node]
+
+            # Epsilon-greedy, choosing uniformly among the other actions when exploring
+            greedy = AUP_Q[active, state].argmax(axis=1)
+            other = rng.integers(max(num_actions - 1, 1), size=len(active))
+            other += other >= greedy
+            epsilon = np.where(episodes[active] > 2.0 / 3 * self.episodes, self.AUP_epsilon, self.pen_epsilon)
+            action = np.where((rng.random(len(active)) < epsilon) | (num_actions == 1), greedy, other)
+
+            next_node = table.next_nodes[node, action]
+            new_state = table.state_ids[next_node]
+            stepped = time.perf_counter()
+            if num_rewards:
+                # Index [trials, rewards] for all reward functions, or for each trial's own sample of them
+                if self.penalty_samples is None:
+                    trials, states, new_states, sampled, actions = active, state, new_state, slice(None), action
+                else:
+                    trials, states, new_states, actions = active[:, None], state[:, None], new_state[:, None], \
+                        action[:, None]
+                    sampled = np.argpartition(rng.random((len(active), num_rewards)), self.penalty_samples - 1,
+                                              axis=1)[:, :self.penalty_samples]
+                taken = (trials, states, sampled, actions)
+                attainable_error = rewards[trials, new_states, sampled] + self.discount * \
+                    attainable_Q[trials, new_states, sampled].max(axis=-1) - attainable_Q[taken]
+                attainable_Q[taken] += learning_rate * attainable_error
+                if self.state_attainable:
+                    attainable_Q[taken] = np.clip(attainable_Q[taken], 0, 1)
+                if self.td_tolerance is not None:
+                    errors[active] = np.maximum(errors[active], abs(attainable_error).max(axis=1))
+                penalty = self.penalties(attainable_Q[taken], attainable_Q[trials, states, sampled, self.null_action],
+                                         None if self.penalty_samples is None
+                                         else attainable_Q[active, state, :, self.null_action])
+            else:
+                penalty = 0
+            reward = table.rewards[node, action] - penalty
+            AUP_error = reward + self.discount * AUP_Q[active, new_state].max(axis=1) - AUP_Q[active, state, action]
+            AUP_Q[active, state, action] += learning_rate * AUP_error
+            if self.td_tolerance is not None:
+                errors[active] = np.maximum(errors[active], abs(AUP_error))
+
+            nodes[active] = next_node
+            seen[active, new_state] = True
+            steps[active] += 1
+            updated = time.perf_counter()
+            times[active, :2] += np.array([stepped - start, updated - stepped]) / len(active)
+            finished = active[table.terminal[next_node]]
+            if not len(finished): continue
+            td_errors[finished, episodes[finished] % self.td_window] = errors[finished]
+            if self.eval_every:
+                evaluated = finished[episodes[finished] % self.eval_every == 0]
+                self.performance[evaluated, episodes[evaluated] // self.eval_every] = \
+                    table.greedy_hidden_reward(AUP_Q[evaluated])
+                policy = AUP_Q[evaluated].argmax(axis=2)
+                same = (policy == policies[evaluated]).all(axis=1)
+                unchanged[evaluated] = np.where(same, unchanged[evaluated] + 1, 1)
+                policies[evaluated] = policy
+            nodes[finished], errors[finished] = 0, 0
+            episodes[finished] += 1
+
+            stopped = finished[self.converged(td_errors[finished], unchanged[finished])]
+            self.stopping_episodes[stopped] = episodes[stopped]
+            if self.eval_every:
+                for trial in stopped:
+                    self.performance[trial, -(-episodes[trial] // self.eval_every):] = \
+                        table.greedy_hidden_reward(AUP_Q[trial])
+            running[stopped] = False
+            active = active[(episodes[active] < self.episodes) & running[active]]
+
+            times[finished, 2] += (time.perf_counter() - updated) / len(finished)
+            for trial in finished:
+                self.report(trial, episodes[trial] - 1, steps[trial], times[trial].sum(), *times[trial],
+                            seen[trial].sum())
+            steps[finished], times[finished] = 0, 0
+        if not self.eval_every:
+            self.performance[:, 0] = table.greedy_hidden_reward(AUP_Q)
+
+        # Keep the last trial's functions, as sequential training does
+        self.index = table.index
+        self.AUP_Q = DenseQ(self.index, (num_actions,), values=AUP_Q[-1])
+        self.attainable_Q = DenseQ(self.index, (num_rewards, num_actions), values=attainable_Q[-1])
+        self.attainable_R = DenseQ(self.index, (num_rewards,), values=np.array(rewards[-1]))
+        if not self.state_attainable:
+            self.attainable_set = env_helper.RandomRewards(num_rewards, trial_seeds(seed_sequences[-1])[1])
+
+    def solve_attainable(self, rewards):
+        """attainable_Q values over the transition table's states, solved for its [states, rewards] reward matrix."""
+        return solve_attainable_Q(self.transitions, rewards, self.discount, clip=self.state_attainable).values
+
     def act(self, obs):
-        return self.AUP_Q[str(obs['board'])].argmax()
+        return self.greedy_action(str(obs['board']))
+
+    def greedy_action(self, board):
+        if self.use_kernels:
+            state = self.index[board]  # before fetching values, as indexing may grow them
+            return kernels.greedy_action(self.AUP_Q.values, state)
+        return self.AUP_Q[board].argmax()
 
     def behavior_action(self, board):
         """Returns the e-greedy action for the state board string."""
-        greedy = self.AUP_Q[board].argmax()
-        if np.random.random() < self.epsilon or len(self.actions) == 1:
+        greedy = self.greedy_action(board)
+        if self.rng.random() < self.epsilon or len(self.actions) == 1:
             return greedy
+        elif self.use_kernels:
+            return kernels.other_action(greedy, len(self.actions), self.rng.random())
         else:  # choose anything else
-            return np.random.choice(self.actions, p=self.probs[greedy])
+            return self.rng.choice(self.actions, p=self.probs[greedy])
 
-    def get_penalty(self, board, action):
-        if len(self.attainable_set) == 0: return 0
-        action_attainable = self.attainable_Q[board][:, action]
-        null_attainable = self.attainable_Q[board][:, self.null_action]
+    def penalties(self, action_attainable, null_attainable, whole_null=None):
+        """Penalties for the attainable utilities of acting versus doing nothing, over the last axis.
+
+        :param whole_null: The null action's attainable utilities over the whole attainable set, when the others are
+                           only a sample of it. With use_scale, the sample's differences are then scaled up by the
+                           set's size over the sample's and divided by the whole set's scale, for an unbiased estimate.
+        """
         diff = action_attainable - null_attainable
 
         # Scaling number or vector (per-AU)
         if self.use_scale:
-            scale = sum(abs(null_attainable))
-            if scale == 0:
-                scale = 1
-            penalty = sum(abs(diff) / scale)
+            scale = np.sum(abs(null_attainable if whole_null is None else whole_null), axis=-1, keepdims=True)
+            scale[scale == 0] = 1
+            penalty = np.sum(abs(diff) / scale, axis=-1)
+            if whole_null is not None:
+                penalty *= whole_null.shape[-1] / diff.shape[-1]
         else:
             scale = np.copy(null_attainable)
             scale[scale == 0] = 1  # avoid division by zero
-            penalty = np.average(np.divide(abs(diff), scale))
+            penalty = np.average(np.divide(abs(diff), scale), axis=-1)
 
         # Scaled difference between taking action and doing nothing
         return self.lambd * penalty  # ImpactUnit is 0!
 
     def update_greedy(self, last_board, action, time_step):
-        """Perform TD update on observed reward."""
-        learning_rate = 1
+        """Perform TD update on observed reward, followed by any planning updates, returning its largest TD error."""
         new_board = str(time_step.observation['board'])
+        last, new = self.index[last_board], self.index[new_board]
+        if len(self.attainable_set) and self.attainable_R is not None:  # else looked up as backups need them
+            self.attainable_rewards(new, new_board)
+        error = self.backup(last, action, new, time_step.reward)
+        if self.planning_steps:
+            self.remember(last, action, new, time_step.reward)
+            self.plan(last, action, error)
+        return error
+
+    def backup(self, last, action, new, reward, learning_rate=1):
+        """TD update of every Q-function for a transition between state IDs, returning the largest TD error. The
+        attainable rewards of the new state must already have been looked up.
+        """
+        if self.use_kernels:
+            scalar = self.dtype.type  # keeps the kernels' arithmetic in the tables' dtype, as NumPy's
+            return kernels.backup(self.attainable_Q.values, self.attainable_R.values, self.AUP_Q.values, last, action,
+                                  new, scalar(reward), self.null_action, scalar(self.discount), scalar(self.lambd),
+                                  scalar(learning_rate), self.use_scale, self.state_attainable)
+        error = 0
 
-        def calculate_update(attainable_idx=None):
-            """Do the update for the main function (or the attainable function at the given index)."""
-            if attainable_idx is not None:
-                reward = self.attainable_set[attainable_idx](new_board) if self.state_attainable \
-                    else self.attainable_set[attainable_idx][new_board]
-                new_Q, old_Q = self.attainable_Q[new_board][attainable_idx].max(), \
-                               self.attainable_Q[last_board][attainable_idx, action]
+        # Learn all the attainable reward functions (or a sample of them) at once
+        if len(self.attainable_set):
+            rewards = slice(None) if self.penalty_samples is None \
+                else self.rng.permutation(len(self.attainable_set))[:self.penalty_samples]
+            if self.attainable_backend == 'linear':
+                attainable_error, last_Q = self.linear_update(last, action, new, rewards, learning_rate)
             else:
-                reward = time_step.reward - self.get_penalty(last_board, action)
-                new_Q, old_Q = self.AUP_Q[new_board].max(), self.AUP_Q[last_board][action]
-            return learning_rate * (reward + self.discount * new_Q - old_Q)
+                attainable_error, last_Q = self.table_update(last, action, new, rewards, learning_rate)
+            error = abs(attainable_error).max()
+            penalty = self.penalties(last_Q[..., rewards, action], last_Q[..., rewards, self.null_action],
+                                     None if self.penalty_samples is None else last_Q[..., self.null_action])
+        else:
+            penalty = 0
 
-        # Learn the attainable reward functions
-        for attainable_idx in range(len(self.attainable_set)):
-            self.attainable_Q[last_board][attainable_idx, action] += calculate_update(attainable_idx)
+        AUP_Q = self.AUP_Q.values
+        AUP_error = reward - penalty + self.discount * AUP_Q[new].max(axis=-1) - AUP_Q[last, ..., action]
+        AUP_Q[last, ..., action] += learning_rate * AUP_error
+        return max(error, abs(AUP_error).max())
+
+    def table_update(self, last, action, new, rewards, learning_rate):
+        """The attainable part of backup() for a DenseQ, returning the TD errors of the given reward functions and
+        the last state's updated Q-values.
+        """
+        attainable_Q = self.attainable_Q.values  # fetched once both states are indexed, as indexing may grow it
+        attainable_error = self.attainable_R.values[new, rewards] + \
+            self.discount * attainable_Q[new, rewards].max(axis=1) - attainable_Q[last, rewards, action]
+        attainable_Q[last, rewards, action] += learning_rate * attainable_error
         if self.state_attainable:
-            self.attainable_Q[last_board][:, action] = np.clip(self.attainable_Q[last_board][:, action], 0, 1)
-        self.AUP_Q[last_board][action] += calculate_update()
+            attainable_Q[last, rewards, action] = np.clip(attainable_Q[last, rewards, action], 0, 1)
+        return attainable_error, attainable_Q[last]
+
+    def linear_update(self, last, action, new, rewards, learning_rate):
+        """The attainable part of backup() for LinearAttainableQ, returning the TD errors of the given reward
+        functions and the last state's updated Q-values.
+        """
+        last_Q, new_Q = self.attainable_Q.state(last), self.attainable_Q.state(new)
+        new_R = self.attainable_rewards(new, self.index.boards[new])
+        attainable_error = new_R[rewards] + self.discount * new_Q[rewards].max(axis=1) - last_Q[rewards, action]
+        self.attainable_Q.update(last, action, learning_rate * attainable_error, rewards)
+        return attainable_error, self.attainable_Q.state(last)
+
+    def remember(self, last, action, new, reward):
+        """Add a transition between state IDs to the model planning replays."""
+        if (last, action) not in self.predecessors[new]:  # boards can hide state, so may lead to several
+            self.predecessors[new].append((last, action))
+        if (last, action) not in self.model:
+            self.remembered.append((last, action))
+        self.model[last, action] = (new, reward)
+
+    def plan(self, last, action, error):
+        """Dyna-Q: replay planning_steps remembered transitions, either at random or by prioritized sweeping from the
+        transition just taken.
+        """
+        if not self.prioritized:
+            for _ in range(self.planning_steps):
+                key = self.remembered[self.rng.integers(len(self.remembered))]
+                self.backup(*key, *self.model[key])
+            return
+
+        self.enqueue(error, (last, action))
+        for _ in range(self.planning_steps):
+            if not self.queue: break
+            _, key = heapq.heappop(self.queue)
+            self.backup(*key, *self.model[key])
+            for predecessor in self.predecessors[key[0]]:
+                # A zero learning rate measures the TD error without changing anything
+                self.enqueue(self.backup(*predecessor, *self.model[predecessor], learning_rate=0), predecessor)
+
+    def enqueue(self, error, key):
+        if error > self.sweep_threshold:
+            heapq.heappush(self.queue, (-error, key))  # largest error first
+
+    def attainable_rewards(self, state, board):
+        """The reward each attainable function gives for entering the state, evaluated once per state and kept in
+        attainable_R, or each time without one.
+        """
+        rewards = self.attainable_R.values[state] if self.attainable_R is not None \
+            else np.full(len(self.attainable_set), np.nan, dtype=self.dtype)
+        if np.isnan(rewards[0]):
+            rewards[:] = [reward(board) for reward in self.attainable_set] if self.state_attainable \
+                else self.attainable_set(board)
+        return rewards
+
+
+def trial_seeds(seed_sequence):
+    """The children a trial's seed spawns for its exploration and its random rewards, which would otherwise share
+    their seed words. Derived rather than spawned, so that asking again gives the same two.
+    """
+    return [np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (child,))
+            for child in range(2)]
+
+
+def train_trial(agent, env, trial, seed_sequence, keep_learned):
+    """Run one of the agent's trials in a worker process.
+
+    :returns performance:
+    :returns stopping_episode:
+    :returns learned: The trial's Q-functions and attainable set if keep_learned, else None.
+    """
+    performance = agent.run_trial(env, trial, seed_sequence)
+    learned = {name: getattr(agent, name) for name in ('index', 'attainable_Q', 'AUP_Q', 'attainable_R',
+                                                       'attainable_set')} if keep_learned else None
+    return performance, agent.stopping_episode, learned
+
+
+def hogwild_worker(agent, env, trial, index, blocks, shapes, seed_sequence, claimed, evaluations, numbered):
+    """Train on episodes claimed from the shared counter until the agent's episodes run out, updating the Q arrays
+    in the shared memory blocks in place and numbering states in the SharedStateIndex. Puts the (state, board) pairs
+    it numbered on the numbered queue when done, even if it fails.
+    """
+    AUP_Q, attainable_Q, attainable_R = [np.ndarray(shape, dtype=agent.dtype, buffer=block.buf)
+                                         for block, shape in zip(blocks, shapes)]
+    index.numbered = []  # those of this process only
+    agent.rng = np.random.default_rng(seed_sequence)
+    agent.index = index
+    agent.AUP_Q = DenseQ(agent.index, shapes[0][1:], values=AUP_Q)
+    agent.attainable_Q = DenseQ(agent.index, shapes[1][1:], values=attainable_Q)
+    agent.attainable_R = DenseQ(agent.index, shapes[2][1:], values=attainable_R, fill=np.nan)
+    agent.model, agent.predecessors, agent.queue = dict(), defaultdict(list), []
+    agent.remembered = []
+    try:
+        while True:
+            with claimed.get_lock():
+                episode = claimed.value
+                claimed.value += 1
+            if episode >= agent.episodes: break
+            agent.epsilon = agent.AUP_epsilon if episode > 2.0 / 3 * agent.episodes else agent.pen_epsilon
+            start = time.perf_counter()
+            steps, _, env_time, update_time = agent.train_episode(env)
+            eval_start = time.perf_counter()
+            if agent.eval_every and episode % agent.eval_every == 0:
+                shared = agent.AUP_Q  # evaluated as of this episode's end, whatever the other workers do meanwhile
+                agent.AUP_Q = DenseQ(agent.index, shared.shape, values=shared.values.copy())
+                evaluations[episode // agent.eval_every] = agent.evaluate(env)
+                agent.AUP_Q = shared
+            end = time.perf_counter()
+            agent.report(trial, episode, steps, end - start, env_time, update_time, end - eval_start,
+                         len(agent.index))
+    finally:
+        numbered.put([(index.ids[board], board) for board in index.numbered])
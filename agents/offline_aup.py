@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import experiments.env_helper as env_helper
+from agents.model_free_aup import ModelFreeAUPAgent
+from agents.tables import DenseQ
+from agents.value_iteration import reward_matrix
+
+
+def summarize(records, num_states, num_actions, chunk_size=1 << 20):
+    """
+    Collapse logged transitions into the distinct ones, read chunk by chunk so that the log need not fit in memory.
+
+    :returns: Distinct (state, action, next_state, last) arrays, sorted by state and action, with how many times
+              each was logged and its mean reward.
+    """
+    codes, counts, rewards = np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        chunk_codes = ((chunk['state'].astype(np.int64) * num_actions + chunk['action']) * num_states
+                       + chunk['next_state']) * 2 + chunk['last']
+        codes, inverse = np.unique(np.concatenate([codes, chunk_codes]), return_inverse=True)
+        counts = np.bincount(inverse, np.concatenate([counts, np.ones(len(chunk))]), minlength=len(codes))
+        rewards = np.bincount(inverse, np.concatenate([rewards, chunk['reward']]), minlength=len(codes))
+    pairs, next_states, last = codes // (2 * num_states), codes // 2 % num_states, codes % 2 == 1
+    return pairs // num_actions, pairs % num_actions, next_states, last, counts, rewards / np.maximum(counts, 1)
+
+
+def fitted_Q(pairs, next_states, last, counts, rewards, num_states, num_actions, discount, clip=False, tolerance=1e-6,
+             max_iterations=10000):
+    """
+    Batched fitted Q-iteration over distinct transitions: each sweep sets every logged state-action pair's Q-values
+    to the count-weighted mean of its transitions' targets. Pairs never logged stay 0, as in the online tables.
+
+    :param pairs: [transitions] state * num_actions + action, sorted.
+    :param rewards: [transitions, ...] reward for each of any number of reward functions.
+    :returns Q: [states, actions, ...]
+    """
+    first = np.r_[True, pairs[1:] != pairs[:-1]]  # of each pair's run of transitions
+    starts, groups = np.flatnonzero(first), np.cumsum(first) - 1
+    weights = (counts / np.add.reduceat(counts, starts)[groups]).reshape((-1,) + (1,) * (rewards.ndim - 1))
+    bootstrap = discount * ~last.reshape(weights.shape)  # episodes end on the last transition
+    Q = np.zeros((num_states * num_actions,) + rewards.shape[1:])
+    for _ in range(max_iterations):
+        values = Q.reshape((num_states, num_actions) + rewards.shape[1:]).max(axis=1)[next_states]
+        new_Q = np.zeros_like(Q)
+        new_Q[pairs[starts]] = np.add.reduceat(weights * (rewards + bootstrap * values), starts)
+        if clip:
+            np.clip(new_Q, 0, 1, out=new_Q)
+        converged = np.abs(new_Q - Q).max(initial=0) <= tolerance
+        Q = new_Q
+        if converged: break
+    return Q.reshape((num_states, num_actions) + rewards.shape[1:])
+
+
+class OfflineAUPAgent():
+    """
+    AUP learned entirely from a TransitionLog, without stepping the env: the attainable set is fitted first, then
+    one AUP Q-function per lambd value penalized by it. As nothing depends on how the transitions were collected,
+    one exploration run can serve any number of attainable sets and lambd values.
+    """
+    name = "Offline AUP"
+    default = ModelFreeAUPAgent.default
+
+    def __init__(self, env, log, lambd=default['lambd'], state_attainable=False, num_rewards=default['rpenalties'],
+                 discount=default['discount'], use_scale=False, seed=None, tolerance=1e-6, max_iterations=10000,
+                 dtype=np.float32, head=0):
+        """
+        :param env: Simulator the log was recorded in, for its actions.
+        :param log: TransitionLog.
+        :param lambd: Impact tuning parameter, or an array of them to learn an AUP_Q head for each.
+        :param state_attainable: True - generate state indicator rewards for each state in the env.
+        :param num_rewards: Size of the random attainable set, |\mathcal{R}|.
+        :param discount:
+        :param use_scale: Whether to scale penalties by the sum of the null action's attainable values.
+        :param seed: Of the random attainable set.
+        :param tolerance: Stop fitting once no value changes by more than this.
+        :param max_iterations: Of fitting.
+        :param dtype: Of the learned tables.
+        :param head: Flat index of the lambd value whose AUP_Q head act() follows.
+        """
+        self.lambd, self.discount, self.use_scale = np.asarray(lambd, dtype=float), discount, use_scale
+        self.heads = self.lambd.shape
+        self.head = head
+        self.state_attainable = state_attainable
+        self.actions = range(len(env.actions))
+        self.null_action = env.actions['null']
+        self.attainable_set = env_helper.derive_possible_rewards(env) if state_attainable \
+            else env_helper.RandomRewards(num_rewards, seed)
+        if len(self.attainable_set) == 0:
+            self.name = 'Offline standard'  # no penalty applied!
+
+        self.index = log.index
+        num_states, num_actions = len(self.index), len(self.actions)
+        states, actions, next_states, last, counts, rewards = summarize(log.records(), num_states, num_actions)
+        pairs = states * num_actions + actions
+        fit = dict(pairs=pairs, next_states=next_states, last=last, counts=counts, num_states=num_states,
+                   num_actions=num_actions, discount=discount, tolerance=tolerance, max_iterations=max_iterations)
+
+        attainable_R = reward_matrix(self.attainable_set, self.index)  # [states, rewards]
+        attainable_Q = fitted_Q(rewards=attainable_R[next_states], clip=state_attainable, **fit)
+        penalty = self.penalties(attainable_Q, attainable_Q[:, self.null_action:self.null_action + 1])[pairs]
+        AUP_Q = fitted_Q(rewards=rewards.reshape((-1,) + (1,) * len(self.heads)) - penalty, **fit)
+
+        self.attainable_Q = DenseQ(self.index, (len(self.attainable_set), num_actions),
+                                   values=np.moveaxis(attainable_Q, 1, -1).astype(dtype))
+        self.AUP_Q = DenseQ(self.index, self.heads + (num_actions,), values=np.moveaxis(AUP_Q, 1, -1).astype(dtype))
+
+    def penalties(self, attainable_Q, null_attainable):
+        """[states * actions, heads] penalties of each action, given [states, actions, rewards] attainable values
+        and those of the null action, as ModelFreeAUPAgent penalizes them.
+        """
+        if len(self.attainable_set) == 0:
+            return np.zeros((attainable_Q.shape[0] * attainable_Q.shape[1],) + self.heads)
+        diff = attainable_Q - null_attainable
+        if self.use_scale:
+            scale = np.sum(abs(null_attainable), axis=-1, keepdims=True)
+            scale[scale == 0] = 1
+            penalty = np.sum(abs(diff) / scale, axis=-1)
+        else:
+            scale = np.copy(null_attainable)
+            scale[scale == 0] = 1  # avoid division by zero
+            penalty = np.average(np.divide(abs(diff), scale), axis=-1)
+        return penalty.reshape(-1, *(1,) * len(self.heads)) * self.lambd
+
+    def act(self, obs):
+        """The greedy action of the chosen head, for env_helper.run_episode; as in evaluate, states missing from the
+        log act as though their Q-values were all 0."""
+        board = str(obs['board'])
+        if board not in self.AUP_Q:
+            return 0
+        return self.AUP_Q[board][np.unravel_index(self.head, self.heads)].argmax()
+
+    def evaluate(self, env):
+        """The hidden reward of following each head's greedy policy for an episode; states missing from the log
+        act as though their Q-values were all 0."""
+        table = env_helper.compile_transitions(env)
+        AUP_Q = np.zeros((len(table.index),) + self.AUP_Q.shape)
+        for state, board in enumerate(table.index.boards):
+            if board in self.AUP_Q:
+                AUP_Q[state] = self.AUP_Q[board]
+        return table.greedy_hidden_reward(np.moveaxis(AUP_Q, 0, -2))
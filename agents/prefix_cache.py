@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+
+class PrefixCache():
+    """
+    Environment checkpoints keyed by the action sequence that reaches them from reset(), stored in a trie so that
+    the deepest checkpointed ancestor of any sequence is found in one walk. Least recently used checkpoints are
+    dropped once the cache is full.
+    """
+
+    class Node():
+        __slots__ = ('parent', 'action', 'children', 'checkpoint')
+
+        def __init__(self, parent=None, action=None):
+            self.parent, self.action = parent, action
+            self.children, self.checkpoint = dict(), None
+
+    def __init__(self, capacity=5000):
+        """
+        :param capacity: Maximum number of checkpoints held.
+        """
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.root = self.Node()
+        self.lru = OrderedDict()  # nodes holding a checkpoint, least recently used first
+
+    def __len__(self):
+        return len(self.lru)
+
+    def deepest(self, actions):
+        """The length of the longest checkpointed prefix of the actions and its checkpoint, or (0, None)."""
+        node, depth, found = self.root, 0, (0, None)
+        if node.checkpoint is not None:
+            found = (0, node)
+        for action in actions:
+            node = node.children.get(action)
+            if node is None: break
+            depth += 1
+            if node.checkpoint is not None:
+                found = (depth, node)
+        depth, node = found
+        if node is None: return 0, None
+        self.lru.move_to_end(node)
+        return depth, node.checkpoint
+
+    def store(self, actions, checkpoint):
+        """Checkpoint the state reached by the action sequence."""
+        if self.capacity <= 0: return
+        node = self.root
+        for action in actions:
+            if action not in node.children:
+                node.children[action] = self.Node(node, action)
+            node = node.children[action]
+        node.checkpoint = checkpoint
+        self.lru[node] = None
+        self.lru.move_to_end(node)
+        while len(self.lru) > self.capacity:
+            self.evict(self.lru.popitem(last=False)[0])
+
+    def evict(self, node):
+        """Drop the node's checkpoint, pruning branches of the trie left without any."""
+        node.checkpoint = None
+        while node.parent is not None and not node.children and node.checkpoint is None:
+            del node.parent.children[node.action]
+            node = node.parent
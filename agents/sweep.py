@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+from agents.model_free_aup import ModelFreeAUPAgent
+from agents.value_iteration import solve_attainable_Q
+
+
+class SweepAUPAgent(ModelFreeAUPAgent):
+    """
+    Model-free AUP trained for every value of a swept parameter at once. The attainable set's updates don't depend on
+    lambd, so each trial learns it once, while AUP_Q gains a heads axis holding one Q-function per value, all updated
+    off-policy from the same transitions. performance and counts gain the same axis, after the trials axis.
+    Exploration follows one head's greedy policy, so every other head learns from that policy's states yet is
+    evaluated on its own greedy rollout, through states it may rarely have updated. Its results can differ from those
+    of an agent trained separately with its value.
+
+    Sweeping num_rewards learns only the largest attainable set: the set of size k is its first k reward functions,
+    so each head's penalty is taken over a prefix of it. Sweeping the discount gives attainable_Q the same heads axis,
+    before its rewards axis, as both the attainable and AUP Q-functions depend on it.
+    """
+    keywords = {'lambd': 'lambd', 'num_rewards': 'rpenalties', 'discount': 'discount'}  # to the key in default
+
+    def __init__(self, env, keyword, values, behavior_head=None, **kwargs):
+        """
+        :param env: Simulator.
+        :param keyword: Which parameter to sweep.
+        :param values: The values to learn a head for.
+        :param behavior_head: Index of the head whose greedy policy explores; by default that of the value closest
+                              to the parameter's default.
+        :param kwargs: As for ModelFreeAUPAgent, except batched and Hogwild training. Evaluation always runs over
+                       the env's compiled transition table.
+        """
+        if keyword not in self.keywords:
+            raise ValueError("Can't sweep {}.".format(keyword))
+        if kwargs.get('batched') or kwargs.get('hogwild'):
+            raise ValueError("Sweeps don't support batched or Hogwild training.")
+        if keyword == 'num_rewards' and (kwargs.get('state_attainable') or kwargs.get('penalty_samples')):
+            raise ValueError("Sweeping num_rewards needs the whole random attainable set.")
+        if keyword == 'discount' and kwargs.get('attainable_backend', 'table') != 'table':
+            raise ValueError("Sweeping the discount needs the table backend.")
+        self.keyword, self.values = keyword, np.array(values)
+        self.heads = (len(self.values),)
+        self.behavior_head = int(np.argmin(abs(self.values - self.default[self.keywords[keyword]]))) \
+            if behavior_head is None else behavior_head
+        kwargs['fast_eval'] = True
+        if keyword == 'lambd':
+            kwargs['lambd'] = self.values.astype(float)  # penalties() scales by every value at once
+        elif keyword == 'num_rewards':
+            kwargs['num_rewards'] = int(self.values.max())
+        elif keyword == 'discount':
+            self.attainable_heads = self.heads
+            kwargs['discount'] = self.values.astype(float)
+        super().__init__(env, **kwargs)
+
+    def checkpoint_config(self):
+        config = json.loads(super().checkpoint_config())
+        config.update(keyword=self.keyword, values=self.values.tolist(), behavior_head=int(self.behavior_head))
+        return json.dumps(config, sort_keys=True)
+
+    def greedy_action(self, board):
+        return self.AUP_Q[board][self.behavior_head].argmax()
+
+    def penalties(self, action_attainable, null_attainable, whole_null=None):
+        """As for ModelFreeAUPAgent, but for num_rewards sweeps over each head's prefix of the attainable set, giving
+        the heads axis in place of the last one."""
+        if self.keyword != 'num_rewards':
+            return super().penalties(action_attainable, null_attainable, whole_null)
+        diff = abs(action_attainable - null_attainable)
+
+        if self.use_scale:
+            scale = self.prefix_sums(abs(null_attainable))
+            scale[scale == 0] = 1
+            penalty = self.prefix_sums(diff) / scale
+        else:
+            scale = np.copy(null_attainable)
+            scale[scale == 0] = 1  # avoid division by zero
+            penalty = self.prefix_sums(diff / scale) / np.maximum(self.values, 1)  # an empty set's penalty is 0
+
+        return self.lambd * penalty
+
+    def prefix_sums(self, values):
+        """Sums of the first k entries of the last axis, for each head's k."""
+        sums = np.cumsum(values, axis=-1)
+        return np.concatenate([np.zeros(sums.shape[:-1] + (1,), sums.dtype), sums], axis=-1)[..., self.values]
+
+    def table_update(self, last, action, new, rewards, learning_rate):
+        """As for ModelFreeAUPAgent, but for discount sweeps updates the attainable set under every discount."""
+        if self.keyword != 'discount':
+            return super().table_update(last, action, new, rewards, learning_rate)
+        attainable_Q = self.attainable_Q.values  # fetched once both states are indexed, as indexing may grow it
+        last_Q = attainable_Q[last]  # [discounts, rewards, actions] view
+        attainable_error = self.attainable_R.values[new, rewards] + \
+            self.discount[:, None] * attainable_Q[new][:, rewards].max(axis=-1) - last_Q[:, rewards, action]
+        last_Q[:, rewards, action] += learning_rate * attainable_error
+        if self.state_attainable:
+            last_Q[:, rewards, action] = np.clip(last_Q[:, rewards, action], 0, 1)
+        return attainable_error, last_Q
+
+    def solve_attainable(self, rewards):
+        if self.keyword != 'discount':
+            return super().solve_attainable(rewards)
+        return np.stack([solve_attainable_Q(self.transitions, rewards, discount, clip=self.state_attainable).values
+                         for discount in self.discount], axis=1)
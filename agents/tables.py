@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import hashlib
+import warnings
+from multiprocessing import Lock, Value, shared_memory
+import numpy as np
+
+
+class StateIndex():
+    """
+    Assigns consecutive integer IDs to board strings as they are first seen.
+    """
+
+    def __init__(self, boards=()):
+        self.ids, self.boards = dict(), []
+        for board in boards:
+            self[board]
+
+    def __getitem__(self, board):
+        state = self.ids.get(board)
+        if state is None:
+            state = self.ids[board] = len(self.boards)
+            self.boards.append(board)
+        return state
+
+    def __contains__(self, board):
+        return board in self.ids
+
+    def __len__(self):
+        return len(self.boards)
+
+
+class SharedStateIndex():
+    """
+    A StateIndex shared by processes: boards get consecutive IDs, whichever process sees them first, up to a fixed
+    capacity. IDs live in an open-addressed hash table of 64-bit board digests in shared memory, taken under a lock
+    only the first time a process looks a board up. Each process keeps the boards it numbered itself in numbered, so
+    that they can be gathered into a StateIndex afterwards.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity: Most boards that can be numbered.
+        """
+        self.capacity = capacity
+        self.num_slots = 1 << int(2 * capacity - 1).bit_length()  # a power of two, at most half full
+        self.block = shared_memory.SharedMemory(create=True, size=16 * self.num_slots)
+        self.lock, self.count = Lock(), Value('l', 0, lock=False)
+        self.table()[:] = 0
+        self.ids, self.numbered = dict(), []
+
+    def table(self):
+        """[slots, 2] board digests and IDs + 1, 0 marking empty slots."""
+        return np.ndarray((self.num_slots, 2), dtype=np.uint64, buffer=self.block.buf)
+
+    def __getitem__(self, board):
+        state = self.ids.get(board)
+        if state is None:
+            digest = int.from_bytes(hashlib.blake2b(board.encode(), digest_size=8).digest(), 'little')
+            table, slot = self.table(), digest & (self.num_slots - 1)
+            with self.lock:
+                while table[slot, 1] and table[slot, 0] != digest:
+                    slot = (slot + 1) & (self.num_slots - 1)
+                if not table[slot, 1]:
+                    if self.count.value >= self.capacity:
+                        raise RuntimeError("More than {} states to number.".format(self.capacity))
+                    table[slot] = digest, self.count.value + 1
+                    self.count.value += 1
+                    self.numbered.append(board)
+                state = self.ids[board] = int(table[slot, 1]) - 1
+        return state
+
+    def __len__(self):
+        return self.count.value
+
+    def close(self, unlink=False):
+        """Release this process's view of the shared memory, freeing it too if unlink."""
+        self.block.close()
+        if unlink:
+            self.block.unlink()
+
+
+def check_precision(dtype, discount, max_reward=1):
+    """
+    Warn if storing Q-values as dtype noticeably distorts learning with the given discount: by rounding the discount
+    enough to change the effective horizon, or by leaving values near the largest return too coarse for small
+    rewards and penalties to register.
+
+    :param dtype: Floating point dtype of the Q arrays.
+    :param discount:
+    :param max_reward: Largest reward per step.
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError("Q-values need a floating point dtype, not {}.".format(dtype))
+    if discount >= 1: return
+    rounded = float(dtype.type(discount))
+    horizon, rounded_horizon = 1 / (1 - discount), 1 / (1 - rounded) if rounded < 1 else np.inf
+    if abs(rounded_horizon - horizon) > .01 * horizon:
+        warnings.warn("A discount of {} is {} in {}, changing the effective horizon from {:.0f} to {:.0f} steps."
+                      .format(discount, rounded, dtype, horizon, rounded_horizon), RuntimeWarning)
+    largest = max_reward * horizon
+    if largest > np.finfo(dtype).max:
+        warnings.warn("Returns of up to {:.0f} overflow {}.".format(largest, dtype), RuntimeWarning)
+    elif np.spacing(dtype.type(largest)) > 1e-3 * max_reward:
+        warnings.warn("{} only resolves Q-values near the largest return of {:.0f} to {}, too coarse for small "
+                      "rewards and penalties.".format(dtype, largest, np.spacing(dtype.type(largest))),
+                      RuntimeWarning)
+
+
+class DenseQ():
+    """
+    Table stored as one contiguous [states, *shape] array, with rows addressed by the state IDs of a StateIndex
+    that may be shared with other tables. Reads like a defaultdict of zero arrays keyed by board string; code that
+    already holds state IDs should index values directly.
+    """
+
+    def __init__(self, index, shape, dtype=float, values=None, fill=0):
+        """
+        :param index: StateIndex mapping boards to rows.
+        :param shape: Shape of each state's entry, e.g. (num_actions,).
+        :param dtype:
+        :param values: Existing array to wrap instead of allocating one.
+        :param fill: Value of rows for states not yet written.
+        """
+        self.index, self.shape, self.fill = index, tuple(shape), fill
+        self._values = np.full((max(len(index), 16),) + self.shape, fill, dtype=dtype) if values is None else values
+
+    @property
+    def values(self):
+        """The backing array, grown (with fill rows) to cover every state in the index."""
+        if len(self.index) > len(self._values):
+            grown = np.full((max(len(self.index), 2 * len(self._values)),) + self.shape, self.fill,
+                            dtype=self._values.dtype)
+            grown[:len(self._values)] = self._values
+            self._values = grown
+        return self._values
+
+    def __getitem__(self, board):
+        state = self.index[board]
+        return self.values[state]
+
+    def __setitem__(self, board, value):
+        state = self.index[board]
+        self.values[state] = value
+
+    def __contains__(self, board):
+        return board in self.index
+
+    def __iter__(self):
+        return iter(self.index.boards)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __bool__(self):
+        return len(self.index) > 0 and all(self.shape)  # a table over an empty attainable set holds nothing
+
+    def keys(self):
+        return list(self.index.boards)
+
+    def items(self):
+        return [(board, self.values[state]) for state, board in enumerate(self.index.boards)]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+
+FIELDS = ('trial', 'episode', 'steps', 'steps_per_second', 'wall_time', 'env_time', 'update_time', 'eval_time',
+          'states', 'epsilon', 'phase')
+
+
+class Sink():
+    """
+    Telemetry callback appending each record to a file. The file is opened on first use in each process, so sinks
+    can be handed to worker processes; records from several processes interleave by line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __call__(self, record):
+        if self.file is None:
+            self.file = open(self.path, 'a', newline='')
+            self.start()
+        self.write(record)
+        self.file.flush()
+
+    def __getstate__(self):
+        return dict(self.__dict__, file=None)
+
+    def start(self):
+        pass
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class JSONLSink(Sink):
+    """Writes each record as a line of JSON."""
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+
+class CSVSink(Sink):
+    """Writes each record as a CSV row of FIELDS, with a header row at the top of a new file."""
+
+    def start(self):
+        self.writer = csv.DictWriter(self.file, FIELDS, extrasaction='ignore')
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+
+    def __getstate__(self):
+        return dict(super().__getstate__(), writer=None)
+
+    def write(self, record):
+        self.writer.writerow(record)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import numpy as np
+from agents.tables import StateIndex
+
+# One fixed-width little-endian record per transition, with no padding or header, so a log is a flat array
+RECORD = np.dtype([('state', '<i4'), ('action', '<i1'), ('next_state', '<i4'), ('reward', '<f4'),
+                   ('hidden_reward', '<f4'), ('last', '?')])
+
+
+class TransitionLog():
+    """
+    Transitions between board states, stored as RECORDs in a binary file that can be memory-mapped however large it
+    grows. State IDs number the boards of a sidecar file (the log's path plus '.boards') holding one JSON string per
+    line. Appended transitions are buffered and written in chunks, boards first, so the files on disk always agree.
+    Opening an existing log continues it.
+    """
+
+    def __init__(self, path, chunk_size=4096):
+        """
+        :param path: Of the records file.
+        :param chunk_size: How many transitions to buffer before writing them out.
+        """
+        self.path, self.chunk_size = path, chunk_size
+        self.index = StateIndex()
+        if os.path.exists(self.boards_path):
+            with open(self.boards_path) as f:
+                for line in f:
+                    self.index[json.loads(line)]
+        self.saved_boards = len(self.index)
+        self.buffer = []
+
+    @property
+    def boards_path(self):
+        return self.path + '.boards'
+
+    def append(self, board, action, new_board, reward, hidden_reward, last):
+        """Buffer a transition between board strings, writing out the buffer once it holds a chunk."""
+        self.buffer.append((self.index[board], action, self.index[new_board], reward, hidden_reward, last))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered transitions and any boards they introduced."""
+        with open(self.boards_path, 'a') as f:
+            for board in self.index.boards[self.saved_boards:]:
+                f.write(json.dumps(board) + '\n')
+        self.saved_boards = len(self.index)
+        with open(self.path, 'ab') as f:
+            f.write(np.array(self.buffer, dtype=RECORD).tobytes())
+        self.buffer = []
+
+    def records(self):
+        """Every written transition, as a read-only memory map of RECORDs."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return np.zeros(0, dtype=RECORD)  # np.memmap can't map an empty file
+        return np.memmap(self.path, dtype=RECORD, mode='r')
+
+    def __len__(self):
+        written = os.path.getsize(self.path) // RECORD.itemsize if os.path.exists(self.path) else 0
+        return written + len(self.buffer)
+
+
+def record_transitions(env, log, episodes, seed=None):
+    """
+    Log the transitions of episodes of uniformly random actions, which any number of offline learners can then
+    share.
+
+    :param env: Simulator.
+    :param log: TransitionLog to append to; it is flushed at the end.
+    :param episodes:
+    :param seed: For the random actions.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(episodes):
+        time_step = env.reset()
+        while not time_step.last:
+            last_board, hidden_before = str(env.get_obs()['board']), env._get_hidden_reward()
+            action = int(rng.integers(len(env.actions)))
+            time_step = env.step(action)
+            log.append(last_board, action, str(time_step.observation['board']),
+                       time_step.reward if time_step.reward else 0, env._get_hidden_reward() - hidden_before,
+                       time_step.last)
+    log.flush()
+    env.reset()
+    return log
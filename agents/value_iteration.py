@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import agents.kernels as kernels
+from agents.tables import DenseQ
+import experiments.env_helper as env_helper
+
+
+def reward_matrix(attainable_set, index):
+    """[states, rewards] reward for entering each board of the index, for an attainable set given as a list of
+    reward functions or dicts, or as one function returning every reward at once, like RandomRewards."""
+    if callable(attainable_set):
+        rows = [attainable_set(board) for board in index.boards]
+    else:
+        rows = [[reward(board) if callable(reward) else reward[board] for reward in attainable_set]
+                for board in index.boards]
+    return np.array(rows, dtype=float).reshape(len(index), len(attainable_set))
+
+
+def solve_attainable_Q(transitions, attainable_set, discount=.996, clip=False, tolerance=1e-8,
+                       max_iterations=100000, dtype=float):
+    """
+    Solve the attainable set's Q-functions by value iteration over the env's full simulator states, all reward
+    functions at once, then average the nodes that show the same board into one row per board. Terminal states are
+    worth nothing, as they are never acted from.
+
+    The values are exact only where each board is one node. Boards that hide state, like every board of dog, are
+    averaged uniformly over their nodes. That is neither the true value of acting on the board nor what a TD learner
+    keyed by board converges to, as that weights nodes by how often it visits them, so treat the result as an
+    approximation on such envs.
+
+    :param transitions: TransitionTable of a deterministic env, or the env itself.
+    :param attainable_set: Reward functions, RandomRewards, or a [states, rewards] array over the table's board IDs.
+    :param discount:
+    :param clip: Clip values to [0, 1] after each sweep, as ModelFreeAUPAgent does for state indicator rewards.
+    :param tolerance: Stop once no value changes by more than this.
+    :param max_iterations:
+    :param dtype: Of the returned values; the iteration itself runs in float64.
+    :returns attainable_Q: DenseQ over the table's index, read like any other attainable_Q.
+    """
+    if not isinstance(transitions, env_helper.TransitionTable):
+        transitions = env_helper.compile_transitions(transitions)
+    rewards = attainable_set if isinstance(attainable_set, np.ndarray) \
+        else reward_matrix(attainable_set, transitions.index)
+    num_states, num_rewards = rewards.shape
+    num_actions = transitions.next_nodes.shape[1]
+
+    entered = rewards[transitions.state_ids[transitions.next_nodes]]  # [nodes, actions, rewards]
+    Q = np.zeros((len(transitions), num_actions, num_rewards))
+    for _ in range(max_iterations):
+        Q, change = kernels.bellman_sweep(entered, transitions.next_nodes, transitions.terminal, Q, discount, clip)
+        if change <= tolerance: break
+
+    board_Q = np.zeros((num_states, num_rewards, num_actions))
+    np.add.at(board_Q, transitions.state_ids, Q.transpose(0, 2, 1))
+    board_Q /= np.maximum(np.bincount(transitions.state_ids, minlength=num_states), 1)[:, None, None]
+    return DenseQ(transitions.index, (num_rewards, num_actions), values=board_Q.astype(dtype, copy=False))
@@ -66,7 +66,7 @@ class BoxEnvironment(GridWorld):
         self.goal_reward = 1
 
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         board[tuple(self._agent_location)] = 1
         board[tuple(self._target_location)] = 2
@@ -74,11 +74,14 @@ class BoxEnvironment(GridWorld):
             for wall in self._walls:
                 board[tuple(wall)] = 3
         board[tuple(self._box_loc)] = 4
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
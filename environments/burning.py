@@ -63,7 +63,7 @@ class BurningEnvironment(GridWorld):
         self.goal_reward = 1
 
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         board[tuple(self._agent_location)] = 1
         board[tuple(self._target_location)] = 2
@@ -79,11 +79,14 @@ class BurningEnvironment(GridWorld):
         # obstacle is 9
         if self._obstacle:
             board[tuple(self._obstacle_loc)] = 9
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
@@ -82,7 +82,7 @@ class ConveyorEnvironment(GridWorld):
         self._max_moves = 20
 
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         if self._walls is not None:
             for wall in self._walls:
@@ -99,11 +99,14 @@ class ConveyorEnvironment(GridWorld):
             board[tuple(conveyor)] = 10
         board[tuple(self._box_loc)] = 4
         board[tuple(self._agent_location)] = 1
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
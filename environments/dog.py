@@ -64,7 +64,7 @@ class DogEnvironment(GridWorld):
 
         self.goal_reward = 1
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         board[tuple(self._agent_location)] = 1
         board[tuple(self._target_location)] = 2
@@ -75,11 +75,14 @@ class DogEnvironment(GridWorld):
         # box is 4
         # dog is 5
         board[tuple(self._dog_loc)] = 5
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
@@ -84,6 +84,27 @@ class GridWorld(gym.Env):
         
         # NOTE: render and StepResult return handled in derived class
 
+    def checkpoint(self):
+        """Snapshot of the simulator state, which restore() returns to. Cheaper than replaying from reset()."""
+        # state is only ever reassigned, never mutated in place, so a shallow copy suffices
+        return {k: v for k, v in self.__dict__.items() if k not in ('window', 'clock')}
+
+    def restore(self, checkpoint):
+        """Return to a state saved by checkpoint()."""
+        self.__dict__.update(checkpoint)
+
+    def state_key(self):
+        """Hashable summary of the state that determines future dynamics. Accumulated rewards are left out, so that
+        states reached along different paths compare equal."""
+        key = []
+        for name, value in sorted(self.__dict__.items()):
+            if name in ('secret_reward', 'episode_return'): continue
+            if isinstance(value, np.ndarray):
+                key.append((name, value.tobytes()))
+            elif isinstance(value, (bool, int, float, str, np.generic)):
+                key.append((name, value))
+        return tuple(key)
+
     def intersects_wall(self, pos):
         return np.any(np.all(self._walls == pos, axis=1))
     
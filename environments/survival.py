@@ -69,7 +69,7 @@ class SurvivalEnvironment(GridWorld):
         self.goal_reward = 1
         self._timeout = 2
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         board[tuple(self._agent_location)] = 1
         board[tuple(self._target_location)] = 2
@@ -90,11 +90,14 @@ class SurvivalEnvironment(GridWorld):
             board[tuple(self._alert_loc)] = 8
 
         # TODO: why do we need an alert? can't we just have it happen randomly?
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
@@ -81,7 +81,7 @@ class SushiEnvironment(GridWorld):
         self.no_sushi = -2
 
 
-    def get_obs(self):
+    def get_board(self):
         board = np.zeros((self.size, self.size))
         board[tuple(self._agent_location)] = 1
         board[tuple(self._target_location)] = 2
@@ -99,11 +99,14 @@ class SushiEnvironment(GridWorld):
         if self._sushi:
             board[tuple(self._sushi_loc)] = 4
         board[tuple(self._human_loc)] = 5
+        return board
 
+    def get_obs(self):
+        board = self.get_board()
         rgb = np.transpose(
                 np.array(pygame.surfarray.pixels3d(self.render())), axes=(2, 1, 0)
             )
-        return {"board": np.array2string(board), "RGB": rgb}
+        return {"board": np.array2string(board, threshold=board.size), "RGB": rgb}  # never summarized
 
     def reset(self, seed=None, options=None):
         # in case we ever use the RNG
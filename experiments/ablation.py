@@ -1,5 +1,5 @@
 from environments import *
-from agents.aup import AUPAgent
+from agents.aup import AUPAgent, MultiAUPPlanner
 from agents.model_free_aup import ModelFreeAUPAgent
 from .env_helper import *
 import datetime
@@ -74,8 +74,8 @@ def run_agents(env_class, env_kwargs, render_ax=None):
     """
     # Instantiate environment and agents
     env = env_class(**env_kwargs)
-    model_free = ModelFreeAUPAgent(env, trials=1)
-    state = (ModelFreeAUPAgent(env, state_attainable=True, trials=1))
+    model_free = ModelFreeAUPAgent(env, trials=1, warm_start=True)
+    state = ModelFreeAUPAgent(env, state_attainable=True, trials=1)
     movies, agents = [], [ModelFreeAUPAgent(env, num_rewards=0, trials=1),  # vanilla
                           AUPAgent(attainable_Q=model_free.attainable_Q, baseline='start'),
                           AUPAgent(attainable_Q=model_free.attainable_Q, baseline='inaction'),
@@ -85,6 +85,10 @@ def run_agents(env_class, env_kwargs, render_ax=None):
                           AUPAgent(attainable_Q=model_free.attainable_Q)  # full AUP
                           ]
 
+    # The AUP variants differ only in their penalties, so plan for all of them in a single search
+    env.reset()
+    MultiAUPPlanner([agent for agent in agents if isinstance(agent, AUPAgent)]).get_actions(env, steps_left=9)
+
     for agent in agents:
         ret, _, perf, frames = run_episode(agent, env, save_frames=True, render_ax=render_ax)
         movies.append((agent.name, frames))
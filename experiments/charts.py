@@ -1,9 +1,13 @@
 from environments import *
 from agents.model_free_aup import ModelFreeAUPAgent
+from agents.sweep import SweepAUPAgent
 from .env_helper import *
+import argparse
 import os
+import shutil
 import numpy as np
 import matplotlib.pyplot as plt
+from functools import partial
 from multiprocessing import Pool
 
 settings = [{'label': r'$\gamma$', 'iter': [1 - 2 ** (-n) for n in range(3, 11)],
@@ -124,25 +128,58 @@ def make_charts():
     plt.show()
 
 
-def run_exp(ind):
+def clear_checkpoints():
+    """Delete the checkpoints of earlier runs, so that the next run_exp starts afresh."""
+    shutil.rmtree(os.path.join(os.path.dirname(__file__), 'plots', 'checkpoints'), ignore_errors=True)
+
+
+def run_exp(ind, sweep=False):
+    """
+    Train agents for every value of the setting in each game, saving their counts and performance for make_charts.
+    Continues from the checkpoints of an interrupted run; a checkpoint saved with other settings is refused, but
+    changes to the code go unnoticed, so clear_checkpoints() after making them.
+
+    :param ind: Of the setting.
+    :param sweep: Learn every value in one SweepAUPAgent training instead of one ModelFreeAUPAgent each. Its heads
+                  other than the default value's learn off-policy, so they need not agree with separate training.
+    """
     setting = settings[ind]
     print(setting['label'])
 
     counts, perf = dict(), dict()
     for (game, kwargs) in games:
+        checkpoint_dir = os.path.join(os.path.dirname(__file__), 'plots', 'checkpoints',
+                                      '{}-{}'.format(game.name, setting['keyword']))
         counts[game.name] = np.zeros((len(setting['iter']), 4))
+        if sweep:
+            agent = SweepAUPAgent(game(**kwargs), setting['keyword'], setting['iter'], trials=50, seed=0,
+                                  checkpoint_dir=checkpoint_dir + '-sweep')
         for (idx, item) in enumerate(setting['iter']):
-            env = game(**kwargs)
-            model_free = ModelFreeAUPAgent(env, trials=50, **{setting['keyword']: item})
+            if sweep:
+                item_counts, performance = agent.counts[idx], agent.performance[:, :, idx]
+            else:
+                model_free = ModelFreeAUPAgent(game(**kwargs), trials=50, seed=0,
+                                               checkpoint_dir='{}-{}'.format(checkpoint_dir, idx),
+                                               **{setting['keyword']: item})
+                item_counts, performance = model_free.counts, model_free.performance
             if setting['keyword'] == 'lambd' and item == ModelFreeAUPAgent.default['lambd']:
-                perf[game.name] = model_free.performance
-            counts[game.name][idx, :] = model_free.counts[:]
-            print(game.name.capitalize(), setting['keyword'], item, model_free.counts)
+                perf[game.name] = performance
+            counts[game.name][idx, :] = item_counts
+            print(game.name.capitalize(), setting['keyword'], item, item_counts)
     np.save(os.path.join(os.path.dirname(__file__), 'plots', 'performance'), perf)
     np.save(os.path.join(os.path.dirname(__file__), 'plots', 'counts-' + setting['keyword']), counts)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the sweeps behind the charts, then draw them.")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Delete the checkpoints of earlier runs instead of resuming from them.")
+    parser.add_argument('--sweep', action='store_true',
+                        help="Learn each setting's values in one training with off-policy heads, instead of training "
+                             "an agent per value as the paper does.")
+    args = parser.parse_args()
+    if args.fresh:
+        clear_checkpoints()
     p = Pool(3)
-    p.map(run_exp, range(len(settings)))
+    p.map(partial(run_exp, sweep=args.sweep), range(len(settings)))
     make_charts()
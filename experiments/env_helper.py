@@ -1,8 +1,51 @@
 from __future__ import print_function
+import hashlib
 import itertools
 import matplotlib.pyplot as plt
 import numpy as np
 from agents.aup import AUPAgent
+from agents.prefix_cache import PrefixCache
+from agents.tables import StateIndex
+
+
+class StateIndicator():
+    """
+    Reward function paying goal_reward for being in the given board state. A class rather than a closure so that
+    attainable sets can be pickled into worker processes.
+    """
+
+    def __init__(self, state, goal_reward):
+        self.state = state
+        self.goal_reward = goal_reward
+
+    def __call__(self, obs):
+        return int(obs == self.state) * self.goal_reward
+
+
+class RandomRewards():
+    """
+    A whole attainable set of random reward functions, each paying a uniform [0, 1) reward for being in a board
+    state. Rewards are hashed from the seed and the board rather than drawn and stored, so any process can recreate
+    the set from its seed, and every function's reward for a board comes back as one vector.
+    """
+
+    def __init__(self, num_rewards, seed=None):
+        """
+        :param num_rewards: Size of the attainable set.
+        :param seed: Anything np.random.SeedSequence takes, or a SeedSequence.
+        """
+        self.num_rewards = num_rewards
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.key = seed.generate_state(4).tolist()
+
+    def __call__(self, obs):
+        """[num_rewards] float32 rewards for the board, the first k of which are also those of a set of size k."""
+        digest = hashlib.blake2b(obs.encode(), digest_size=8).digest()
+        return np.random.default_rng(self.key + [int.from_bytes(digest, 'little')]).random(self.num_rewards,
+                                                                                              dtype=np.float32)
+
+    def __len__(self):
+        return self.num_rewards
 
 
 def derive_possible_rewards(env):
@@ -12,29 +55,104 @@ def derive_possible_rewards(env):
     :param env:
     """
 
-    def state_lambda(original_board_str):
-        return lambda obs: int(obs == original_board_str) * env.goal_reward
-
     def explore(env, so_far=[]):  # visit all possible states
         board_str = str(env.get_obs()['board'])
         if board_str not in states:
             states.add(board_str)
-            fn = state_lambda(board_str)
-            fn.state = board_str
-            functions.append(fn)
+            functions.append(StateIndicator(board_str, env.goal_reward))
             if not env.terminated:
                 for act_name in env.actions:
                     env.step(env.actions[act_name])
                     explore(env, so_far + [env.actions[act_name]])
-                    AUPAgent.restart(env, so_far)
+                    AUPAgent.restart(env, so_far, cache)
 
     env.reset()
-    states, functions = set(), []
+    states, functions, cache = set(), [], PrefixCache()
     explore(env)
     env.reset()
     return functions
 
 
+class TransitionTable():
+    """
+    An environment's deterministic dynamics over every state reachable from reset(), as arrays indexed by node.
+    Node 0 is the reset state and terminal nodes loop back on themselves. Nodes are full simulator states, so
+    several may show the same board; state_ids maps each node to its board's ID in index.
+    """
+
+    def __init__(self, index, state_ids, next_nodes, rewards, hidden_rewards, terminal):
+        """
+        :param index: StateIndex numbering the boards.
+        :param state_ids: [nodes] board ID of each node.
+        :param next_nodes: [nodes, actions] node reached by taking the action.
+        :param rewards: [nodes, actions] observed reward for taking the action.
+        :param hidden_rewards: [nodes, actions] change in the hidden reward from taking the action.
+        :param terminal: [nodes] whether the episode is over.
+        """
+        self.index = index
+        self.state_ids = state_ids
+        self.next_nodes = next_nodes
+        self.rewards = rewards
+        self.hidden_rewards = hidden_rewards
+        self.terminal = terminal
+
+    def __len__(self):
+        return len(self.state_ids)
+
+    def greedy_hidden_reward(self, AUP_Q, max_len=9):
+        """The hidden reward run_episode would record for acting greedily on each of the given Q arrays.
+
+        :param AUP_Q: [..., states, actions] Q-values over the board IDs of index.
+        :param max_len: How long the agent acts for.
+        """
+        batch_shape = AUP_Q.shape[:-2]
+        AUP_Q = AUP_Q.reshape((-1,) + AUP_Q.shape[-2:])
+        rows, nodes = np.arange(len(AUP_Q)), np.zeros(len(AUP_Q), dtype=int)
+        hidden = np.zeros(len(AUP_Q))
+        for _ in range(max_len):
+            actions = AUP_Q[rows, self.state_ids[nodes]].argmax(axis=1)
+            hidden += self.hidden_rewards[nodes, actions]
+            nodes = self.next_nodes[nodes, actions]
+        return hidden.reshape(batch_shape)
+
+
+def compile_transitions(env, index=None):
+    """
+    Enumerate the states reachable from env.reset() and tabulate the dynamics between them.
+
+    :param env:
+    :param index: StateIndex to number boards in; a new one by default.
+    """
+    index = StateIndex() if index is None else index
+    env.reset()
+    nodes = {env.state_key(): 0}
+    checkpoints, state_ids, terminal = [env.checkpoint()], [index[str(env.get_obs()['board'])]], [False]
+    next_nodes, rewards, hidden_rewards = [], [], []
+    node = 0
+    while node < len(checkpoints):  # breadth-first, as checkpoints grows
+        next_nodes.append([node] * len(env.actions))
+        rewards.append([0] * len(env.actions))
+        hidden_rewards.append([0] * len(env.actions))
+        for action in range(len(env.actions)):
+            if terminal[node]: break
+            env.restore(checkpoints[node])
+            hidden_before = env._get_hidden_reward()
+            time_step = env.step(action)
+            key = env.state_key()
+            if key not in nodes:
+                nodes[key] = len(checkpoints)
+                checkpoints.append(env.checkpoint())
+                state_ids.append(index[str(time_step.observation['board'])])
+                terminal.append(bool(time_step.last))
+            next_nodes[node][action] = nodes[key]
+            rewards[node][action] = time_step.reward if time_step.reward else 0
+            hidden_rewards[node][action] = env._get_hidden_reward() - hidden_before
+        node += 1
+    env.reset()
+    return TransitionTable(index, np.array(state_ids), np.array(next_nodes), np.array(rewards, dtype=float),
+                           np.array(hidden_rewards, dtype=float), np.array(terminal))
+
+
 def run_episode(agent, env, save_frames=False, render_ax=None, max_len=9):
     """
     Run the episode, recording and saving the frames if desired.
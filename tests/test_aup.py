@@ -0,0 +1,26 @@
+import pytest
+from environments import box, dog, sushi
+from agents.aup import AUPAgent, MultiAUPPlanner
+from agents.model_free_aup import ModelFreeAUPAgent
+
+
+def ablation_variants(env):
+    """Fresh AUPAgents for the ablation's baselines and deviations, over solved random and state attainable sets."""
+    random = ModelFreeAUPAgent(env, trials=1, episodes=1, seed=0, warm_start=True).attainable_Q
+    state = ModelFreeAUPAgent(env, trials=1, episodes=1, seed=0, warm_start=True, state_attainable=True).attainable_Q
+    return lambda: [AUPAgent(random), AUPAgent(random, baseline='start'), AUPAgent(random, baseline='inaction'),
+                    AUPAgent(random, deviation='decrease'), AUPAgent(state, baseline='inaction', deviation='decrease'),
+                    AUPAgent(random, use_scale=True)]
+
+
+@pytest.mark.parametrize('game', [box.BoxEnvironment, dog.DogEnvironment, sushi.SushiEnvironment])
+def test_multi_planner_matches_separate_agents(game):
+    env = game(level=0)
+    env.window_size = 16  # rendering is never looked at
+    variants = ablation_variants(env)
+    separate = []
+    for agent in variants():
+        env.reset()
+        separate.append(agent.get_actions(env, steps_left=5))
+    env.reset()
+    assert MultiAUPPlanner(variants()).get_actions(env, steps_left=5) == separate
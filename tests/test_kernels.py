@@ -0,0 +1,116 @@
+import importlib.util
+import sys
+import numpy as np
+import pytest
+import agents.kernels as kernels
+from environments import box
+from agents.model_free_aup import ModelFreeAUPAgent
+
+pytestmark = pytest.mark.skipif(kernels.numba is None, reason="the Numba kernels need numba")
+
+DTYPES = [np.float32, np.float64]
+
+
+def rtol(dtype):
+    """Relative tolerance for sums taken in another order: a hundred units in the last place."""
+    return 100 * np.finfo(dtype).eps
+
+
+@pytest.fixture(scope='module')
+def numpy_kernels():
+    """agents.kernels as loaded without Numba, keeping only the NumPy versions."""
+    saved = sys.modules['numba']
+    sys.modules['numba'] = None  # makes the import fail
+    try:
+        spec = importlib.util.spec_from_file_location('numpy_kernels', kernels.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.modules['numba'] = saved
+    assert module.numba is None
+    return module
+
+
+def random_tables(rng, dtype, num_states, num_rewards, num_actions, null_action):
+    attainable_Q = (rng.random((num_states, num_rewards, num_actions)) * 3).astype(dtype)
+    attainable_Q[0, :num_rewards // 2, null_action] = 0  # for the zero scales
+    attainable_R = rng.random((num_states, num_rewards)).astype(dtype)
+    AUP_Q = rng.random((num_states, num_actions)).astype(dtype)
+    return attainable_Q, attainable_R, AUP_Q
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+@pytest.mark.parametrize('num_rewards', [1, 7, 30, 200])
+@pytest.mark.parametrize('use_scale', [False, True])
+def test_penalty_matches_numpy(numpy_kernels, dtype, num_rewards, use_scale):
+    rng = np.random.default_rng(num_rewards)
+    attainable_Q, _, _ = random_tables(rng, dtype, 6, num_rewards, 5, 2)
+    for state in range(6):
+        for action in range(5):
+            expected = numpy_kernels.penalty(attainable_Q, state, action, 2, dtype(.66), use_scale)
+            np.testing.assert_allclose(kernels.penalty(attainable_Q, state, action, 2, dtype(.66), use_scale),
+                                       expected, rtol=rtol(dtype))
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+@pytest.mark.parametrize('num_rewards', [0, 1, 7, 30, 200])
+@pytest.mark.parametrize('use_scale', [False, True])
+@pytest.mark.parametrize('clip', [False, True])
+def test_backup_matches_numpy(numpy_kernels, dtype, num_rewards, use_scale, clip):
+    rng = np.random.default_rng(num_rewards)
+    tables = random_tables(rng, dtype, 6, num_rewards, 5, 2)
+    copies = tuple(table.copy() for table in tables)
+    for _ in range(50):
+        last, action, new = rng.integers(6), rng.integers(5), rng.integers(6)
+        args = (last, action, new, dtype(rng.random()), 2, dtype(.996), dtype(1 / 1.501), dtype(rng.integers(2)),
+                use_scale, clip)
+        np.testing.assert_allclose(kernels.backup(*copies, *args), numpy_kernels.backup(*tables, *args),
+                                   rtol=rtol(dtype))
+    for table, copy in zip(tables, copies):
+        np.testing.assert_allclose(copy, table, rtol=rtol(dtype), atol=rtol(dtype))
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_greedy_action_matches_numpy(numpy_kernels, dtype):
+    rng = np.random.default_rng(0)
+    Q = rng.integers(3, size=(100, 5)).astype(dtype)  # plenty of ties
+    for state in range(len(Q)):
+        assert kernels.greedy_action(Q, state) == numpy_kernels.greedy_action(Q, state)
+
+
+def test_other_action_matches_numpy(numpy_kernels):
+    rng = np.random.default_rng(0)
+    for num_actions in (2, 5, 9):
+        for greedy in range(num_actions):
+            for draw in rng.random(200):
+                expected = numpy_kernels.other_action(greedy, num_actions, draw)
+                assert kernels.other_action(greedy, num_actions, draw) == expected
+
+
+@pytest.mark.parametrize('clip', [False, True])
+def test_bellman_sweep_matches_numpy(numpy_kernels, clip):
+    rng = np.random.default_rng(0)
+    Q, entered = rng.random((50, 5, 7)) * 2, rng.random((50, 5, 7))
+    next_nodes, terminal = rng.integers(50, size=(50, 5)), rng.random(50) < .2
+    new_Q, change = kernels.bellman_sweep(entered, next_nodes, terminal, Q, .9, clip)
+    expected_Q, expected_change = numpy_kernels.bellman_sweep(entered, next_nodes, terminal, Q, .9, clip)
+    assert np.array_equal(new_Q, expected_Q) and change == expected_change
+
+
+@pytest.mark.parametrize('settings', [dict(), dict(use_scale=True), dict(num_rewards=0), dict(state_attainable=True),
+                                      dict(dtype=np.float64)])
+def test_training_matches_without_kernels(settings):
+    agents = []
+    for use_kernels in (True, False):
+        env = box.BoxEnvironment(level=0)
+        env.window_size = 16  # rendering is never looked at
+        agents.append(ModelFreeAUPAgent(env, trials=1, episodes=20, seed=0, fast_eval=True, use_kernels=use_kernels,
+                                        **settings))
+    with_kernels, without = agents
+    assert with_kernels.use_kernels and not without.use_kernels
+    assert np.array_equal(with_kernels.performance, without.performance)
+    tolerance = 10 * rtol(settings.get('dtype', np.float32))  # rounding differences compound over training
+    np.testing.assert_allclose(with_kernels.AUP_Q.values[:len(with_kernels.index)],
+                               without.AUP_Q.values[:len(without.index)], rtol=tolerance, atol=tolerance)
+    np.testing.assert_allclose(with_kernels.attainable_Q.values[:len(with_kernels.index)],
+                               without.attainable_Q.values[:len(without.index)], rtol=tolerance, atol=tolerance)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from agents.linear_q import LinearAttainableQ
+from agents.tables import StateIndex
+
+
+def test_observed_features_match_parsed():
+    board = np.random.default_rng(0).integers(20, size=(6, 6))
+    observed, parsed = (LinearAttainableQ(StateIndex(), board.shape, 3, 5) for _ in range(2))
+    observed.observe(str(board), board)
+    assert np.array_equal(observed.features(str(board)), parsed.features(str(board)))
+
+
+def test_large_boards_parse_from_full_strings():
+    board = np.random.default_rng(0).integers(20, size=(40, 40))
+    with np.printoptions(threshold=board.size):
+        full = str(board)
+    observed, parsed = (LinearAttainableQ(StateIndex(), board.shape, 3, 5, recent=1) for _ in range(2))
+    with pytest.raises(ValueError, match='summarized'):
+        parsed.features(str(board))
+    observed.observe(full, board)
+    assert np.array_equal(observed.features(full), parsed.features(full))
+    observed.observe('other', np.zeros_like(board))  # evicts the board's features, to be parsed again
+    assert full not in observed.recent
+    assert np.array_equal(observed.features(full), parsed.features(full))
+
+
+def test_board_of_other_shape_refused():
+    attainable_Q = LinearAttainableQ(StateIndex(), (5, 5), 3, 5)
+    with pytest.raises(ValueError, match='board_shape'):
+        attainable_Q.observe('board', np.zeros((6, 6)))
@@ -0,0 +1,114 @@
+import itertools
+import numpy as np
+import pytest
+from environments import box
+from agents.model_free_aup import ModelFreeAUPAgent, trial_seeds
+
+
+def make_env():
+    env = box.BoxEnvironment(level=0)
+    env.window_size = 16  # rendering is never looked at
+    return env
+
+
+def test_early_stopping_stops_at_td_window():
+    records = []
+    agent = ModelFreeAUPAgent(make_env(), trials=2, episodes=30, seed=0, fast_eval=True, td_tolerance=1e9,
+                              td_window=2, telemetry=records.append)
+    assert agent.stopping_episodes.tolist() == [2, 2]
+    assert [(record['trial'], record['episode']) for record in records] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+def test_early_stopping_matches_batched():
+    kwargs = dict(trials=2, episodes=30, seed=0, td_tolerance=1e9, td_window=2)
+    sequential = ModelFreeAUPAgent(make_env(), fast_eval=True, **kwargs)
+    batched = ModelFreeAUPAgent(make_env(), batched=True, **kwargs)
+    assert np.array_equal(sequential.stopping_episodes, batched.stopping_episodes)
+
+
+def test_checkpoint_refused_with_other_settings(tmp_path):
+    kwargs = dict(trials=1, episodes=10, seed=0, fast_eval=True, checkpoint_dir=str(tmp_path))
+    ModelFreeAUPAgent(make_env(), **kwargs)
+    for changed in (dict(lambd=.1), dict(episodes=20)):
+        with pytest.raises(ValueError, match='different configuration'):
+            ModelFreeAUPAgent(make_env(), **dict(kwargs, **changed))
+
+
+def test_checkpointing_needs_seed(tmp_path):
+    with pytest.raises(ValueError, match='seed'):
+        ModelFreeAUPAgent(make_env(), trials=1, episodes=10, checkpoint_dir=str(tmp_path))
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize('planning', [dict(planning_steps=3), dict(planning_steps=3, prioritized=True)])
+def test_resumed_planning_matches_uninterrupted(tmp_path, planning):
+    class InterruptedAgent(ModelFreeAUPAgent):
+        def save_checkpoint(self, *args, **kwargs):
+            super().save_checkpoint(*args, **kwargs)
+            raise Interrupted
+
+    kwargs = dict(trials=1, episodes=10, seed=1, fast_eval=True, **planning)
+    with pytest.raises(Interrupted):
+        InterruptedAgent(make_env(), checkpoint_dir=str(tmp_path), checkpoint_every=5, **kwargs)
+    resumed = ModelFreeAUPAgent(make_env(), checkpoint_dir=str(tmp_path), checkpoint_every=5, **kwargs)
+    uninterrupted = ModelFreeAUPAgent(make_env(), **kwargs)
+    assert np.array_equal(resumed.AUP_Q.values[:len(resumed.index)],
+                          uninterrupted.AUP_Q.values[:len(uninterrupted.index)])
+    assert np.array_equal(resumed.performance, uninterrupted.performance)
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')  # float16 is coarse for the default discount
+def test_float16_trains_without_kernels():
+    agent = ModelFreeAUPAgent(make_env(), trials=1, episodes=20, seed=1, fast_eval=True, dtype=np.float16)
+    assert not agent.use_kernels and agent.AUP_Q.values.dtype == np.float16
+    with pytest.raises(ValueError, match='float32 or float64'):
+        ModelFreeAUPAgent(make_env(), trials=1, episodes=20, seed=1, fast_eval=True, dtype=np.float16,
+                          use_kernels=True)
+
+
+def test_linear_backend_keeps_no_attainable_rewards():
+    agent = ModelFreeAUPAgent(make_env(), trials=1, episodes=10, seed=0, fast_eval=True, attainable_backend='linear')
+    assert agent.attainable_R is None and len(agent.attainable_Q.recent) <= agent.attainable_Q.capacity
+
+
+def test_hogwild_numbers_states_as_seen():
+    agent = ModelFreeAUPAgent(make_env(), trials=1, episodes=6, seed=0, workers=2, hogwild=True, eval_every=2)
+    assert agent.transitions is None  # nothing compiled up front
+    assert None not in agent.index.boards and len(set(agent.index.boards)) == len(agent.index)
+    assert agent.performance.shape == (1, 3)
+    with pytest.raises(RuntimeError, match='Hogwild worker failed'):
+        ModelFreeAUPAgent(make_env(), trials=1, episodes=6, seed=0, workers=2, hogwild=True, hogwild_capacity=3)
+
+
+@pytest.mark.parametrize('use_scale', [False, True])
+def test_sampled_penalty_is_unbiased(use_scale):
+    agent = ModelFreeAUPAgent.__new__(ModelFreeAUPAgent)  # penalties() only needs these
+    agent.use_scale, agent.lambd = use_scale, 1.
+    action_attainable, null_attainable = np.random.default_rng(0).random((2, 6))
+    whole = agent.penalties(action_attainable, null_attainable)
+    samples = [agent.penalties(action_attainable[sample], null_attainable[sample], null_attainable)
+               for sample in map(list, itertools.combinations(range(6), 2))]
+    assert np.isclose(np.mean(samples), whole)
+
+
+def test_exploration_and_rewards_seeded_apart():
+    seed_sequence = np.random.SeedSequence(0).spawn(3)[1]
+    explore_seed, rewards_seed = trial_seeds(seed_sequence)
+    assert [child.spawn_key for child in (explore_seed, rewards_seed)] == \
+        [child.spawn_key for child in seed_sequence.spawn(2)]
+    assert not np.array_equal(explore_seed.generate_state(4), rewards_seed.generate_state(4))
+    assert not np.array_equal(explore_seed.generate_state(4), seed_sequence.generate_state(4))
+    assert [child.spawn_key for child in trial_seeds(seed_sequence)] == [(1, 0), (1, 1)]  # unchanged by spawning
+
+
+def test_results_independent_of_workers():
+    agents = [ModelFreeAUPAgent(make_env(), trials=3, episodes=20, eval_every=2, seed=0, fast_eval=True,
+                                workers=workers) for workers in (1, 2)]
+    one, two = agents
+    assert np.array_equal(one.performance, two.performance)
+    assert np.array_equal(one.counts, two.counts)
+    assert np.array_equal(one.stopping_episodes, two.stopping_episodes)
+    assert np.array_equal(one.AUP_Q.values[:len(one.index)], two.AUP_Q.values[:len(two.index)])  # the last trial's
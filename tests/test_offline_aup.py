@@ -0,0 +1,52 @@
+from collections import defaultdict
+import numpy as np
+import experiments.env_helper as env_helper
+from environments import box
+from agents.offline_aup import OfflineAUPAgent, fitted_Q, summarize
+from agents.transition_log import TransitionLog, record_transitions
+
+
+def test_recorded_log_reopens_fits_and_acts(tmp_path):
+    env = box.BoxEnvironment(level=0)
+    env.window_size = 16  # rendering is never looked at
+    path = str(tmp_path / 'box.log')
+    written = record_transitions(env, TransitionLog(path, chunk_size=64), episodes=50, seed=0)
+    log = TransitionLog(path)
+    assert len(log) == len(written)
+    assert log.index.boards == written.index.boards
+    assert np.array_equal(log.records(), written.records())
+
+    agent = OfflineAUPAgent(env, log, lambd=[0, .66, 5], seed=0)
+    for head, hidden_reward in enumerate(agent.evaluate(env)):
+        agent.head = head
+        _, actions, performance, _ = env_helper.run_episode(agent, env)
+        assert performance == hidden_reward
+        assert len(actions)
+
+
+def test_summarize_matches_counting(tmp_path):
+    env = box.BoxEnvironment(level=0)
+    env.window_size = 16
+    log = record_transitions(env, TransitionLog(str(tmp_path / 'box.log')), episodes=20, seed=1)
+    records = log.records()
+    counts, rewards = defaultdict(int), defaultdict(float)
+    for record in records:
+        key = int(record['state']), int(record['action']), int(record['next_state']), bool(record['last'])
+        counts[key] += 1
+        rewards[key] += record['reward']
+    keys = sorted(counts)
+
+    states, actions, next_states, last, summed, mean_rewards = summarize(records, len(log.index), len(env.actions),
+                                                                         chunk_size=100)  # over several chunks
+    assert list(zip(states.tolist(), actions.tolist(), next_states.tolist(), last.tolist())) == keys
+    assert summed.tolist() == [counts[key] for key in keys]
+    np.testing.assert_allclose(mean_rewards, [rewards[key] / counts[key] for key in keys], rtol=1e-6)
+
+
+def test_fitted_Q_weights_transitions_by_count():
+    # State 0: action 0 steps to state 1; action 1 ends the episode in state 2 three times out of four, and steps to
+    # state 1 otherwise. State 1: action 0 ends the episode with reward 1; action 1 was never logged.
+    pairs, next_states = np.array([0, 1, 1, 2]), np.array([1, 1, 2, 2])
+    last, counts, rewards = np.array([False, False, True, True]), np.array([2., 1., 3., 5.]), np.array([0, 0, 0, 1.])
+    Q = fitted_Q(pairs, next_states, last, counts, rewards, num_states=3, num_actions=2, discount=.9, tolerance=0)
+    np.testing.assert_allclose(Q, [[.9, .25 * .9], [1, 0], [0, 0]])